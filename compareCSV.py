@@ -1,196 +1,3313 @@
+import abc
+import argparse
+import bisect
+import contextlib
 import csv
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import logging
+import marshal
+import math
+import mmap
+import os
+import pickle
 import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
 
-from typing import List, Dict, Tuple, Any
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Any, Callable, Iterator, Sequence
 
 
-def read_csv(path: str) -> List[Dict[str, str]]:
-    """Read a CSV file into a list of dicts keyed by header."""
+class _StdoutHandler(logging.Handler):
+    """Handler writing to whatever sys.stdout currently is, like print()."""
+
+    terminator = "\n"
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            sys.stdout.write(self.format(record) + self.terminator)
+            self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        with self.lock:
+            if hasattr(sys.stdout, "flush"):
+                sys.stdout.flush()
+
+
+# Progress and report messages. By default they go to stdout at INFO, as
+# plain lines; raise the level (e.g. logger.setLevel(logging.WARNING)) to
+# silence them, or drop the handler and set propagate to route them into
+# an application's own logging setup.
+logger = logging.getLogger("compareCSV")
+if not logger.handlers:
+    _handler = _StdoutHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _field_positions(header: List[str]) -> Dict[str, int]:
+    """Map each header name to its column index (last one wins, as in DictReader)."""
+    return {name: i for i, name in enumerate(header)}
+
+
+def _projection(
+    header: List[str],
+    columns: List[str] | None,
+    path: str,
+) -> Tuple[List[str], List[int]]:
+    """Resolve the output column names and their indexes in header."""
+    positions = _field_positions(header)
+    names = list(dict.fromkeys(header if columns is None else columns))
+    for col in names:
+        if col not in positions:
+            raise ValueError(f"Column '{col}' not found in {path}")
+    return names, [positions[col] for col in names]
+
+
+def _data_rows(reader: Iterator[List[str]], width: int) -> Iterator[List[str]]:
+    """Skip blank lines and pad/truncate records to width, like DictReader."""
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != width:
+            row = (row + [None] * width)[:width]
+        yield row
+
+
+def iter_csv(path: str, columns: List[str] | None = None) -> Iterator[Dict[str, str]]:
+    """Yield rows of a CSV file one at a time as dicts keyed by header.
+
+    If columns is given, each dict only holds those columns.
+    """
     with open(path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+        if columns is None:
+            yield from csv.DictReader(f)
+            return
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        names, idx = _projection(header, columns, path)
+        for row in _data_rows(reader, len(header)):
+            yield {name: row[i] for name, i in zip(names, idx)}
+
+
+def read_csv(
+    path: str,
+    columns: List[str] | None = None,
+    cache: "TableCache | None" = None,
+) -> List[Dict[str, str]]:
+    """Read a CSV file into a list of dicts keyed by header.
+
+    If columns is given, only those columns are kept. With a TableCache the
+    parsed file is loaded from (or stored in) the cache instead of re-parsed.
+    """
+    if cache is not None:
+        return [dict(r) for r in cache.load(path, columns)]
+    return list(iter_csv(path, columns))
+
+
+class CsvSink:
+    """Buffered CSV output that takes rows as they are produced.
+
+    Rows are sequences of values in header order (tuples or lists), so no
+    dict is built per row. They are collected and handed to csv.writer
+    batch_rows at a time through a large file buffer, which makes a write
+    little more than a list append. With path=None rows are only counted.
+    With lazy=True the file (and its header) is only created once the
+    first row arrives. release() closes the file between writes; the next
+    flush reopens it for appending, without writing the header again.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        header: List[str],
+        lazy: bool = False,
+        batch_rows: int = 10_000,
+        buffer_bytes: int = 1024 * 1024,
+    ) -> None:
+        self.path = path
+        self.header = header
+        self.batch_rows = batch_rows
+        self.buffer_bytes = buffer_bytes
+        self.count = 0
+        self._pending: List[Sequence[Any]] = []
+        self._file = None
+        self._writer = None
+        self._started = False
+        if path and not lazy:
+            self._open()
+
+    def _open(self) -> None:
+        self._file = open(
+            self.path,
+            "a" if self._started else "w",
+            newline="",
+            encoding="utf-8",
+            buffering=self.buffer_bytes,
+        )
+        self._writer = csv.writer(self._file)
+        if not self._started:
+            self._writer.writerow(self.header)
+            self._started = True
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def write(self, row: Sequence[Any]) -> None:
+        """Add one row."""
+        self.count += 1
+        if self.path:
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_rows:
+                self.flush()
+
+    def write_dict(self, row: Mapping) -> None:
+        """Add one row given as a mapping; missing columns are left empty."""
+        self.write([row.get(name, "") for name in self.header])
+
+    def writerows(self, rows: Iterator[Sequence[Any]]) -> None:
+        """Add many rows, passing them to the writer batch by batch."""
+        self.flush()
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_rows))
+            if not batch:
+                return
+            self.count += len(batch)
+            if self.path:
+                self._pending = batch
+                self.flush()
+
+    def flush(self) -> None:
+        """Write out the pending rows."""
+        if not self._pending:
+            return
+        if self._writer is None:
+            self._open()
+        self._writer.writerows(self._pending)
+        self._pending = []
+
+    def release(self) -> None:
+        """Write out the pending rows and close the file until the next flush."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def close(self) -> None:
+        self.release()
+
+    def __enter__(self) -> "CsvSink":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class CsvFanout:
+    """Route rows to one CsvSink per label.
+
+    Labels given in outputs get their file created up front (a None path
+    only counts rows). Other labels get a file from template, its
+    '{value}' replaced by a filename-safe form of the label, when their
+    first row arrives, or are only counted if there is no template.
+    Pending rows of all sinks together are bounded by batch_rows, and at
+    most max_open files are open at once: the least recently written one
+    is closed and reopened for appending when it gets rows again, so a
+    split into thousands of files stays under the open files limit.
+    """
+
+    def __init__(
+        self,
+        header: List[str],
+        outputs: Dict[str, str | None] | None = None,
+        template: str | None = None,
+        batch_rows: int = 10_000,
+        max_open: int = 64,
+    ) -> None:
+        self.header = header
+        self.template = template
+        self.batch_rows = batch_rows
+        self.max_open = max(1, max_open)
+        self.sinks: Dict[str, CsvSink] = {}
+        self._used_paths: Dict[str, str] = {}
+        self._pending = 0
+        self._open_labels: Dict[str, None] = {}  # insertion order = LRU order
+        for label, path in (outputs or {}).items():
+            self._add(label, path)
+
+    def _add(self, label: str, path: str | None) -> CsvSink:
+        if path:
+            self._used_paths[path] = label
+        sink = self.sinks[label] = CsvSink(path, self.header, batch_rows=self.batch_rows)
+        self._touch(label, sink)
+        return sink
+
+    def _touch(self, label: str, sink: CsvSink) -> None:
+        """Mark label's file as just used and close the oldest past max_open."""
+        if not sink.is_open:
+            return
+        self._open_labels.pop(label, None)
+        self._open_labels[label] = None
+        while len(self._open_labels) > self.max_open:
+            oldest = next(iter(self._open_labels))
+            del self._open_labels[oldest]
+            self.sinks[oldest].release()
+
+    def sink(self, label: str) -> CsvSink:
+        """The sink for label, created (and its file opened) if new."""
+        sink = self.sinks.get(label)
+        if sink is None:
+            path = None
+            if self.template:
+                path = _output_path_for(self.template, label, self._used_paths)
+            sink = self._add(label, path)
+        return sink
+
+    def write(self, label: str, row: Sequence[Any]) -> None:
+        """Add one row to label's output."""
+        sink = self.sink(label)
+        sink.write(row)
+        self._touch(label, sink)
+        self._pending += 1
+        if self._pending >= self.batch_rows:
+            self.flush()
+
+    def writerows(self, label: str, rows: Iterator[Sequence[Any]]) -> None:
+        """Add many rows to label's output."""
+        sink = self.sink(label)
+        sink.writerows(rows)
+        self._touch(label, sink)
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        return {label: sink.count for label, sink in self.sinks.items()}
+
+    def flush(self) -> None:
+        for label, sink in self.sinks.items():
+            sink.flush()
+            self._touch(label, sink)
+        self._pending = 0
+
+    def close(self) -> None:
+        for sink in self.sinks.values():
+            sink.close()
+        self._open_labels.clear()
+
+    def __enter__(self) -> "CsvFanout":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class Row(Mapping):
+    """Read-only dict-like view of one row of a Table."""
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table: "Table", index: int) -> None:
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key: str) -> str:
+        return self._table.columns[self._table.positions[key]][self._index]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._table.positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table.header)
+
+    def __len__(self) -> int:
+        return len(self._table.header)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class Table:
+    """Column-oriented CSV contents: the header once plus one list per column.
+
+    Iterating or indexing yields Row views, so a Table can stand in for the
+    list of dicts returned by read_csv.
+    """
+
+    def __init__(
+        self,
+        header: List[str],
+        columns: List[List[str]],
+        source: str = "<table>",
+    ) -> None:
+        self.header = header
+        self.columns = columns
+        self.source = source
+        self.positions = {name: i for i, name in enumerate(header)}
+        self._numeric: Dict[Tuple[str, str], "NumericColumn"] = {}
+
+    @classmethod
+    def from_csv(
+        cls,
+        path: str,
+        columns: List[str] | None = None,
+        chunk_rows: int = 10_000,
+        cache: "TableCache | None" = None,
+    ) -> "Table":
+        """Load a CSV column by column, transposing chunk_rows rows at a time.
+
+        If columns is given, only those columns are kept. With a TableCache
+        an unchanged file is loaded from its cached binary copy.
+        """
+        if cache is not None:
+            return cache.load(path, columns)
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            names, idx = _projection(header, columns, path)
+            rows = _data_rows(reader, len(header))
+            if idx != list(range(len(header))):
+                pick = lambda row: [row[i] for i in idx]
+                rows = map(pick, rows)
+            data: List[List[str]] = [[] for _ in names]
+            while True:
+                chunk = list(itertools.islice(rows, chunk_rows))
+                if not chunk:
+                    break
+                for column, values in zip(data, zip(*chunk)):
+                    column.extend(values)
+        return cls(names, data, source=path)
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self) -> Iterator[Row]:
+        return (Row(self, i) for i in range(len(self)))
+
+    def __getitem__(self, index: int) -> Row:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Table index out of range")
+        return Row(self, index)
+
+    def column(self, name: str) -> List[str]:
+        """Return the list of values for one column."""
+        if name not in self.positions:
+            raise ValueError(f"Column '{name}' not found in {self.source}")
+        return self.columns[self.positions[name]]
+
+    def filter(self, mask: Sequence[bool]) -> "Table":
+        """Return a new Table with the rows where mask is true."""
+        columns = [list(itertools.compress(col, mask)) for col in self.columns]
+        return Table(self.header, columns, source=self.source)
+
+    def select(self, columns: List[str]) -> "Table":
+        """Return a Table sharing this one's data but only the given columns."""
+        data = [self.column(name) for name in dict.fromkeys(columns)]
+        return Table(list(dict.fromkeys(columns)), data, source=self.source)
+
+    def take(self, indices: Sequence[int]) -> "Table":
+        """Return a new Table with the rows at the given positions."""
+        columns = [[col[i] for i in indices] for col in self.columns]
+        return Table(self.header, columns, source=self.source)
+
+    def numeric(self, name: str, kind: str = "float") -> "NumericColumn":
+        """Return a column parsed as numbers; parsed once, then reused."""
+        key = (name, kind)
+        if key not in self._numeric:
+            self._numeric[key] = NumericColumn(self.column(name), kind)
+        return self._numeric[key]
+
+    def typed(
+        self,
+        schema: Mapping[str, str] | None = None,
+    ) -> Dict[str, "NumericColumn"]:
+        """Parse every schema column present in the table (column -> kind,
+        WOOCOMMERCE_NUMERIC_COLUMNS by default)."""
+        schema = WOOCOMMERCE_NUMERIC_COLUMNS if schema is None else schema
+        return {
+            name: self.numeric(name, kind)
+            for name, kind in schema.items()
+            if name in self.positions
+        }
+
+    def to_csv(self, path: str) -> None:
+        """Write the table to a CSV file."""
+        with CsvSink(path, self.header) as sink:
+            sink.writerows(zip(*self.columns))
+
+
+WOOCOMMERCE_NUMERIC_COLUMNS = {
+    "Regular price": "float",
+    "Sale price": "float",
+    "Stock": "int",
+    "Low stock amount": "int",
+    "Weight (kg)": "float",
+    "Length (cm)": "float",
+    "Width (cm)": "float",
+    "Height (cm)": "float",
+}
+
+_NUMERIC_TYPECODES = {"float": "d", "int": "q"}
+
+
+def _parse_number(cell: str | None) -> float | None:
+    """float(cell), or None for an empty, non-numeric or non-finite cell.
+
+    Shared by Range, NumericColumn and the numeric compare, so a file scan
+    and a Table give the same answer for 'nan' or 'inf'.
+    """
+    try:
+        num = float(cell)
+    except (TypeError, ValueError):
+        return None
+    return num if math.isfinite(num) else None
+
+
+def _parse_int(cell: str | None) -> int | None:
+    """int(cell), also accepting '5.0'; None for anything else."""
+    try:
+        return int(cell)
+    except (TypeError, ValueError):
+        num = _parse_number(cell)
+        return int(num) if num is not None and num.is_integer() else None
+
+
+def _numbers_equal(v1: str | None, v2: str | None, tolerance: float = 0.0) -> bool:
+    """True when both values parse as numbers within tolerance of each other."""
+    n1 = _parse_number(v1)
+    n2 = _parse_number(v2)
+    return n1 is not None and n2 is not None and abs(n1 - n2) <= tolerance
+
+
+class NumericColumn:
+    """One column parsed once into a compact numeric array.
+
+    values is an array('d') for kind="float" or array('q') for kind="int".
+    Empty and unparseable cells are stored as 0 and flagged in the nulls
+    bitmap (bit i % 8 of nulls[i // 8]). Range masks are computed over the
+    array in one comprehension instead of parsing strings per row.
+    """
+
+    def __init__(self, cells: Sequence[str | None], kind: str = "float") -> None:
+        if kind not in _NUMERIC_TYPECODES:
+            raise ValueError(f"kind must be one of {', '.join(_NUMERIC_TYPECODES)}")
+        self.kind = kind
+        parse = _parse_number if kind == "float" else _parse_int
+        self.values = array(_NUMERIC_TYPECODES[kind])
+        self.nulls = bytearray((len(cells) + 7) // 8)
+        self.null_count = 0
+        append = self.values.append
+        for i, cell in enumerate(cells):
+            num = parse(cell)
+            if num is not None:
+                try:
+                    append(num)
+                    continue
+                except OverflowError:  # beyond 64-bit int
+                    pass
+            append(0)
+            self.nulls[i >> 3] |= 1 << (i & 7)
+            self.null_count += 1
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def is_null(self, index: int) -> bool:
+        return bool(self.nulls[index >> 3] & (1 << (index & 7)))
+
+    def __getitem__(self, index: int) -> float | int | None:
+        return None if self.is_null(index) else self.values[index]
+
+    def _null_ids(self) -> Iterator[int]:
+        for byte_index, byte in enumerate(self.nulls):
+            if byte:
+                base = byte_index << 3
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield base + bit
+
+    def mask(self, low: float | None = None, high: float | None = None) -> List[bool]:
+        """low <= value <= high per row (either bound may be None); nulls are False."""
+        values = self.values
+        if low is not None and high is not None:
+            mask = [low <= v <= high for v in values]
+        elif low is not None:
+            mask = [v >= low for v in values]
+        elif high is not None:
+            mask = [v <= high for v in values]
+        else:
+            mask = [True] * len(values)
+        if self.null_count:
+            for i in self._null_ids():
+                mask[i] = False
+        return mask
+
+    def between(self, low: float | None = None, high: float | None = None) -> List[int]:
+        """Row ids with low <= value <= high, ascending."""
+        return list(itertools.compress(range(len(self.values)), self.mask(low, high)))
+
+
+class TableCache:
+    """On-disk cache of parsed Tables in a compact binary columnar format.
+
+    Each cached CSV gets one file, named after its absolute path. The file
+    holds a JSON header followed by one marshal blob per column, so a
+    projected load only decodes the columns it needs. An entry is used only
+    while the CSV's size, mtime and a sampled content hash (first and last
+    MiB) still match; otherwise it is rebuilt. Entries are evicted least
+    recently used first once the cache grows past max_bytes.
+    """
+
+    MAGIC = b"CSVTBL1\n"
+    _SAMPLE = 1024 * 1024
+
+    def __init__(self, cache_dir: str | None = None, max_bytes: int = 2 * 1024**3) -> None:
+        self.cache_dir = cache_dir or os.environ.get(
+            "COMPARECSV_CACHE_DIR",
+            os.path.join(os.path.expanduser("~"), ".cache", "comparecsv"),
+        )
+        self.max_bytes = max_bytes
+
+    def _entry_path(self, path: str) -> str:
+        digest = hashlib.blake2b(os.path.abspath(path).encode("utf-8"), digest_size=16)
+        return os.path.join(self.cache_dir, digest.hexdigest() + ".tbl")
+
+    def _signature(self, path: str) -> Dict[str, Any]:
+        st = os.stat(path)
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            h.update(f.read(self._SAMPLE))
+            if st.st_size > self._SAMPLE:
+                f.seek(max(self._SAMPLE, st.st_size - self._SAMPLE))
+                h.update(f.read(self._SAMPLE))
+        return {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sample_hash": h.hexdigest(),
+            "python": list(sys.version_info[:2]),  # marshal format is per version
+        }
+
+    def _read_meta(self, f: Any) -> Dict[str, Any] | None:
+        if f.read(len(self.MAGIC)) != self.MAGIC:
+            return None
+        (meta_len,) = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(meta_len))
+
+    def load(self, path: str, columns: List[str] | None = None) -> Table:
+        """Return the parsed Table for path, from the cache when it is current."""
+        entry = self._entry_path(path)
+        signature = self._signature(path)
+        try:
+            f = open(entry, "rb")
+        except OSError:
+            f = None
+        if f is not None:
+            with f:
+                try:
+                    meta = self._read_meta(f)
+                except (OSError, ValueError, EOFError, struct.error):
+                    meta = None
+                if meta is not None and meta.get("signature") == signature:
+                    # Outside the try: an unknown column must not discard the entry
+                    names, idx = _projection(meta["header"], columns, path)
+                    try:
+                        data = self._read_columns(f, meta, idx)
+                    except (OSError, ValueError, EOFError, struct.error):
+                        data = None
+                    if data is not None:
+                        os.utime(entry)  # mark as recently used
+                        return Table(names, data, source=path)
+
+        table = Table.from_csv(path)
+        self._store(entry, table, signature)
+        return table if columns is None else table.select(columns)
+
+    def _read_columns(self, f: Any, meta: Dict[str, Any], idx: List[int]) -> List[List[str]]:
+        base = f.tell()
+        data = []
+        for i in idx:
+            offset, length = meta["blobs"][i]
+            f.seek(base + offset)
+            data.append(marshal.loads(f.read(length)))
+        return data
+
+    def _store(self, entry: str, table: Table, signature: Dict[str, Any]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        blobs = [marshal.dumps(col) for col in table.columns]
+        offsets = []
+        pos = 0
+        for blob in blobs:
+            offsets.append([pos, len(blob)])
+            pos += len(blob)
+        meta = json.dumps({
+            "source": os.path.abspath(table.source),
+            "signature": signature,
+            "header": table.header,
+            "blobs": offsets,
+        }).encode("utf-8")
+        tmp = entry + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack("<I", len(meta)))
+            f.write(meta)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits max_bytes."""
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            if not name.endswith(".tbl"):
+                continue
+            full = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, full))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, full in entries:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(full)
+            total -= size
+
+    def clear(self) -> None:
+        """Remove every cached entry."""
+        for name in os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else []:
+            if name.endswith(".tbl"):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+class Expr(abc.ABC):
+    """Base class for composable row filter expressions.
+
+    Combine with & (AND), | (OR) and ~ (NOT). compile() fuses the whole tree
+    into one generated per-row function over the csv.reader field list;
+    mask() evaluates it column-at-a-time over a Table instead. Expressions
+    are plain picklable objects, so they can be sent to worker processes.
+    """
+
+    @abc.abstractmethod
+    def columns(self) -> List[str]:
+        """Columns this expression reads."""
+
+    @abc.abstractmethod
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        """Python expression text over 'row'; constants are bound into env."""
+
+    @abc.abstractmethod
+    def mask(self, table: Table) -> List[bool]:
+        """Evaluate over a Table, one column at a time."""
+
+    def compile(self, positions: Dict[str, int]) -> Callable[[Sequence[str]], bool]:
+        """Compile to a single function taking a row as a list of fields."""
+        env: Dict[str, Any] = {}
+        source = self._source(positions, env)
+        return eval(f"lambda row: {source}", env)
+
+    def __and__(self, other: "Expr") -> "Expr":
+        return And(self, other)
+
+    def __or__(self, other: "Expr") -> "Expr":
+        return Or(self, other)
+
+    def __invert__(self) -> "Expr":
+        return Not(self)
+
+
+class _Leaf(Expr):
+    """Expression on a single column, defined by test() on one value."""
+
+    def __init__(self, column: str) -> None:
+        self.column = column
+
+    def columns(self) -> List[str]:
+        return [self.column]
+
+    @abc.abstractmethod
+    def test(self, val: str) -> bool:
+        """Evaluate against a single column value."""
+
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        name = f"_t{len(env)}"
+        env[name] = self.test
+        return f"{name}(row[{positions[self.column]}])"
+
+    def mask(self, table: Table) -> List[bool]:
+        return list(map(self.test, table.column(self.column)))
+
+    def _const(self, env: Dict[str, Any], value: Any) -> str:
+        name = f"_c{len(env)}"
+        env[name] = value
+        return name
+
+
+class Eq(_Leaf):
+    """column == value"""
+
+    def __init__(self, column: str, value: str) -> None:
+        super().__init__(column)
+        self.value = value
+
+    def test(self, val: str) -> bool:
+        return val == self.value
+
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        return f"(row[{positions[self.column]}] == {self._const(env, self.value)})"
+
+
+class In(_Leaf):
+    """column value is one of values"""
+
+    def __init__(self, column: str, values: Sequence[str]) -> None:
+        super().__init__(column)
+        self.values = frozenset(values)
+
+    def test(self, val: str) -> bool:
+        return val in self.values
+
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        return f"(row[{positions[self.column]}] in {self._const(env, self.values)})"
+
+
+class Prefix(_Leaf):
+    """column value starts with prefix (optionally trimmed / case-insensitive)"""
+
+    def __init__(
+        self,
+        column: str,
+        prefix: str,
+        case_sensitive: bool = True,
+        trim: bool = True,
+    ) -> None:
+        super().__init__(column)
+        self.prefix = prefix if case_sensitive else prefix.lower()
+        self.case_sensitive = case_sensitive
+        self.trim = trim
+
+    def test(self, val: str) -> bool:
+        if self.trim:
+            val = val.strip()
+        if not self.case_sensitive:
+            val = val.lower()
+        return val.startswith(self.prefix)
+
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        val = f"row[{positions[self.column]}]"
+        if self.trim:
+            val += ".strip()"
+        if not self.case_sensitive:
+            val += ".lower()"
+        return f"{val}.startswith({self._const(env, self.prefix)})"
+
+
+class Regex(_Leaf):
+    """pattern.search(column value) finds a match"""
+
+    def __init__(self, column: str, pattern: str | re.Pattern, flags: int = 0) -> None:
+        super().__init__(column)
+        self.pattern = re.compile(pattern, flags) if isinstance(pattern, str) else pattern
+
+    def test(self, val: str) -> bool:
+        if not val:
+            return False
+        return self.pattern.search(val) is not None
+
+
+class Range(_Leaf):
+    """low <= float(column value) <= high; either bound may be None.
+
+    Empty, non-numeric and non-finite (nan, inf) values never match.
+    """
+
+    def __init__(self, column: str, low: float | None = None, high: float | None = None) -> None:
+        super().__init__(column)
+        self.low = low
+        self.high = high
+
+    def test(self, val: str) -> bool:
+        num = _parse_number(val)
+        if num is None:
+            return False
+        if self.low is not None and num < self.low:
+            return False
+        if self.high is not None and num > self.high:
+            return False
+        return True
+
+    def mask(self, table: Table) -> List[bool]:
+        return table.numeric(self.column).mask(self.low, self.high)
+
+
+_ATTRIBUTE_COLUMN = re.compile(r"Attribute (\d+) (name|value\(s\)|visible|global)")
+_ATTRIBUTE_SEP = re.compile(r"(?<!\\),\s*")
+
+
+def split_attribute_values(cell: str | None) -> List[str]:
+    """Split a WooCommerce list cell ('Attribute N value(s)', 'Tags', ...)
+    into its values.
+
+    Values are separated by ', '; a comma inside a value is written '\\,'.
+    """
+    if not cell:
+        return []
+    return [
+        v.replace("\\,", ",").strip() for v in _ATTRIBUTE_SEP.split(cell) if v.strip()
+    ]
+
+
+def _lists_value(cell: str | None, value: str) -> bool:
+    """True if value is one of split_attribute_values(cell)."""
+    if not cell:
+        return False
+    # Cheap substring check first; most cells don't mention the value. An
+    # escaped comma makes the raw text differ from the value, so skip it then.
+    if value not in cell and "\\," not in cell:
+        return False
+    return value in split_attribute_values(cell)
+
+
+def _attribute_slots(
+    positions: Dict[str, int],
+) -> List[Tuple[int, int | None, int | None, int | None]]:
+    """(name, value(s), visible, global) positions of each 'Attribute N' slot.
+
+    Slots are ordered by N and must have a name column; the other three
+    positions are None when their column is missing.
+    """
+    slots: Dict[int, Dict[str, int]] = {}
+    for column, pos in positions.items():
+        m = _ATTRIBUTE_COLUMN.fullmatch(column)
+        if m:
+            slots.setdefault(int(m.group(1)), {})[m.group(2)] = pos
+    return [
+        (parts["name"], parts.get("value(s)"), parts.get("visible"), parts.get("global"))
+        for _, parts in sorted(slots.items())
+        if "name" in parts
+    ]
+
+
+class Attribute(Expr):
+    """Some 'Attribute N' slot has the given name and/or lists value.
+
+    Every Attribute N name / value(s) column pair of a WooCommerce export
+    is searched, whatever N is; value must be one of the slot's values
+    (see split_attribute_values), not the whole cell. The slot columns are
+    found in the header when the expression is compiled.
+    """
+
+    def __init__(self, name: str | None = None, value: str | None = None) -> None:
+        if name is None and value is None:
+            raise ValueError("Attribute needs a name, a value or both")
+        self.name = name
+        self.value = value
+
+    def columns(self) -> List[str]:
+        return []
+
+    def _pairs(self, positions: Dict[str, int]) -> List[Tuple[int, int | None]]:
+        pairs = [(name, values) for name, values, _, _ in _attribute_slots(positions)]
+        if not pairs:
+            raise ValueError("No 'Attribute N name' columns found")
+        return pairs
+
+    def test_slot(self, name: str | None, values: str | None) -> bool:
+        """Evaluate against one slot's name and value(s) cells."""
+        if self.name is not None and name != self.name:
+            return False
+        if self.value is None:
+            return bool(name)
+        return _lists_value(values, self.value)
+
+    def _row_test(self, pairs: List[Tuple[int, int | None]]) -> Callable[[Sequence[str]], bool]:
+        test_slot = self.test_slot
+
+        def test(row: Sequence[str]) -> bool:
+            return any(
+                test_slot(row[n], None if v is None else row[v]) for n, v in pairs
+            )
+
+        return test
+
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        name = f"_a{len(env)}"
+        env[name] = self._row_test(self._pairs(positions))
+        return f"{name}(row)"
+
+    def mask(self, table: Table) -> List[bool]:
+        pairs = self._pairs(table.positions)
+        return list(map(self._row_test(pairs), zip(*table.columns)))
+
+
+class Contains(_Leaf):
+    """value is one of the items of a comma-separated list column
+
+    For cells such as 'Single Cigar, 5 Cigars, Box of 20 Cigars' or the
+    Categories, Tags and Images columns; see split_attribute_values.
+    """
+
+    def __init__(self, column: str, value: str) -> None:
+        super().__init__(column)
+        self.value = value
+
+    def test(self, val: str) -> bool:
+        return _lists_value(val, self.value)
+
+    def mask(self, table: Table) -> List[bool]:
+        # List cells repeat a lot, so test each distinct cell once
+        seen: Dict[str, bool] = {}
+        mask = []
+        for val in table.column(self.column):
+            hit = seen.get(val)
+            if hit is None:
+                hit = seen[val] = self.test(val)
+            mask.append(hit)
+        return mask
+
+
+class _Compound(Expr):
+    _joiner = ""
+
+    def __init__(self, *parts: Expr) -> None:
+        if not parts:
+            raise ValueError(f"{type(self).__name__} needs at least one expression")
+        self.parts = parts
+
+    def columns(self) -> List[str]:
+        return list(dict.fromkeys(col for p in self.parts for col in p.columns()))
+
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        return "(" + self._joiner.join(p._source(positions, env) for p in self.parts) + ")"
+
+
+class And(_Compound):
+    _joiner = " and "
+
+    def mask(self, table: Table) -> List[bool]:
+        return [all(vals) for vals in zip(*(p.mask(table) for p in self.parts))]
+
+
+class Or(_Compound):
+    _joiner = " or "
+
+    def mask(self, table: Table) -> List[bool]:
+        return [any(vals) for vals in zip(*(p.mask(table) for p in self.parts))]
+
+
+class Not(Expr):
+    def __init__(self, part: Expr) -> None:
+        self.part = part
+
+    def columns(self) -> List[str]:
+        return self.part.columns()
+
+    def _source(self, positions: Dict[str, int], env: Dict[str, Any]) -> str:
+        return f"(not {self.part._source(positions, env)})"
+
+    def mask(self, table: Table) -> List[bool]:
+        return [not m for m in self.part.mask(table)]
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton that finds many keywords in one pass over a text.
+
+    Matching is case-insensitive and anchored at word starts, like the
+    r"\\bkeyword\\w*" regex of the word-prefix filters: "cuba" is found in
+    "Cubana Robusto" but not in "Xcuba". The cost of find() grows with the
+    length of the text, not with the number of keywords.
+    """
+
+    def __init__(self, keywords: Sequence[str]) -> None:
+        self.keywords = list(dict.fromkeys(keywords))
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        self._lengths: List[int] = []
+        for k, keyword in enumerate(self.keywords):
+            word = keyword.lower()
+            if not word:
+                raise ValueError("Keywords must not be empty")
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(k)
+            self._lengths.append(len(word))
+
+        # Breadth-first so every state's failure target is finished first
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def find(self, text: str | None) -> List[str]:
+        """Keywords found in text, in the order they were given."""
+        if not text:
+            return []
+        text = text.lower()
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        hits = set()
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for k in out[state]:
+                start = i - lengths[k]
+                if start < 0 or not (text[start].isalnum() or text[start] == "_"):
+                    hits.add(k)
+        return [self.keywords[k] for k in sorted(hits)]
+
+
+# Routers map a parsed row (list of fields) to a partition label. They are
+# picklable so workers= can ship them to other processes.
+
+
+class _ColumnRouter:
+    """Label rows with route(value of one column)."""
+
+    def __init__(self, column_name: str, route: Callable[[str], str | None]) -> None:
+        self.column_name = column_name
+        self.route = route
+        self.pos = -1
+
+    def columns(self) -> List[str]:
+        return [self.column_name]
+
+    def bind(self, positions: Dict[str, int]) -> "_ColumnRouter":
+        self.pos = positions[self.column_name]
+        return self
+
+    def __call__(self, row: List[str]) -> str | None:
+        return self.route(row[self.pos])
+
+    def labels(self, table: Table) -> List[str | None]:
+        return list(map(self.route, table.column(self.column_name)))
+
+
+class _ExprRouter:
+    """Label rows if_true / if_false depending on a compiled Expr."""
+
+    def __init__(self, expr: Expr, if_true: str | None, if_false: str | None = None) -> None:
+        self.expr = expr
+        self.if_true = if_true
+        self.if_false = if_false
+        self.positions: Dict[str, int] | None = None
+        self._fn: Callable[[Sequence[str]], bool] | None = None
+
+    def columns(self) -> List[str]:
+        return self.expr.columns()
+
+    def bind(self, positions: Dict[str, int]) -> "_ExprRouter":
+        self.positions = positions
+        self._fn = self.expr.compile(positions)
+        return self
+
+    def __call__(self, row: List[str]) -> str | None:
+        return self.if_true if self._fn(row) else self.if_false
+
+    def labels(self, table: Table) -> List[str | None]:
+        return [self.if_true if m else self.if_false for m in self.expr.mask(table)]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The compiled function can't be pickled; rebuild it on the other side
+        state = dict(self.__dict__)
+        state["_fn"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        if self.positions is not None:
+            self._fn = self.expr.compile(self.positions)
+
+
+class _BatchRouter:
+    """Label each row with every query name whose Expr it matches.
+
+    All expressions are fused into one generated function, so a row is
+    tested against every query in a single call.
+    """
+
+    multi = True
+
+    def __init__(self, queries: Dict[str, Expr]) -> None:
+        self.queries = queries
+        self.positions: Dict[str, int] | None = None
+        self._fn: Callable[[Sequence[str]], List[str]] | None = None
+
+    def columns(self) -> List[str]:
+        return list(dict.fromkeys(col for e in self.queries.values() for col in e.columns()))
+
+    def bind(self, positions: Dict[str, int]) -> "_BatchRouter":
+        self.positions = positions
+        env: Dict[str, Any] = {}
+        pairs = []
+        for name, expr in self.queries.items():
+            label = f"_l{len(env)}"
+            env[label] = name
+            pairs.append(f"({label}, {expr._source(positions, env)})")
+        source = f"lambda row: [l for l, hit in ({', '.join(pairs)},) if hit]"
+        self._fn = eval(source, env)
+        return self
+
+    def __call__(self, row: List[str]) -> List[str]:
+        return self._fn(row)
+
+    def labels(self, table: Table) -> List[List[str]]:
+        names = list(self.queries)
+        masks = [self.queries[name].mask(table) for name in names]
+        return [[n for n, hit in zip(names, hits) if hit] for hits in zip(*masks)]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        state["_fn"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        if self.positions is not None:
+            self.bind(self.positions)
+
+
+class _KeywordRouter:
+    """Label rows with the KeywordMatcher keywords found in one column.
+
+    With separator=None every keyword found is a label of its own (one row
+    can go to several outputs); otherwise the row gets a single label, the
+    keywords joined by separator, or empty when nothing is found.
+    """
+
+    def __init__(
+        self,
+        column_name: str,
+        matcher: KeywordMatcher,
+        separator: str | None = None,
+        empty: str | None = None,
+    ) -> None:
+        self.column_name = column_name
+        self.matcher = matcher
+        self.separator = separator
+        self.empty = empty
+        self.multi = separator is None
+        self.pos = -1
+
+    def columns(self) -> List[str]:
+        return [self.column_name]
+
+    def bind(self, positions: Dict[str, int]) -> "_KeywordRouter":
+        self.pos = positions[self.column_name]
+        return self
+
+    def _label(self, val: str) -> List[str] | str | None:
+        found = self.matcher.find(val)
+        if self.multi:
+            return found
+        return self.separator.join(found) if found else self.empty
+
+    def __call__(self, row: List[str]) -> List[str] | str | None:
+        return self._label(row[self.pos])
+
+    def labels(self, table: Table) -> List[Any]:
+        return list(map(self._label, table.column(self.column_name)))
+
+
+def _identity(val: str) -> str:
+    return val
+
+
+_PARALLEL_CHUNK_BYTES = 32 * 1024 * 1024
+
+
+def _chunk_ranges(path: str, start: int, parts: int) -> List[Tuple[int, int]]:
+    """Split path[start:] into byte ranges that begin and end on record boundaries.
+
+    A newline only ends a record when an even number of '"' precede it, so
+    newlines inside quoted fields (e.g. HTML in 'Description') are never
+    used as split points. The scan only counts bytes, it does not parse.
+    """
+    size = os.path.getsize(path)
+    if size <= start:
+        return []
+    step = max(1, (size - start) // parts)
+    targets = [start + step * i for i in range(1, parts)]
+    bounds = [start]
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        in_quotes = False
+        block = b""
+        block_at = start
+        for target in targets:
+            if target <= bounds[-1]:
+                continue
+            while True:
+                if pos >= block_at + len(block):
+                    block_at = pos
+                    block = f.read(4 * 1024 * 1024)
+                    if not block:
+                        break
+                i = pos - block_at
+                nl = block.find(b"\n", i)
+                end = nl if nl != -1 else len(block)
+                if block.count(b'"', i, end) % 2:
+                    in_quotes = not in_quotes
+                pos = block_at + end
+                if nl == -1:
+                    continue
+                pos += 1
+                if not in_quotes and pos > target:
+                    bounds.append(pos)
+                    break
+            if not block:
+                break
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _partition_chunk(
+    path: str,
+    byte_range: Tuple[int, int],
+    width: int,
+    idx: List[int] | None,
+    router: Callable[[List[str]], str | None],
+) -> List[Tuple[str, List[str]]]:
+    """Worker: parse one byte range and return its routed (label, row) pairs."""
+    start, end = byte_range
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+    routed: List[Tuple[str, List[str]]] = []
+    multi = getattr(router, "multi", False)
+    for row in _data_rows(csv.reader(io.StringIO(text, newline="")), width):
+        labels = router(row) if multi else (router(row),)
+        for label in labels:
+            if label is not None:
+                routed.append((label, row if idx is None else [row[i] for i in idx]))
+    return routed
+
+
+def _iter_parallel_rows(
+    path: str,
+    header_end: int,
+    width: int,
+    idx: List[int] | None,
+    router: Callable[[List[str]], str | None],
+    workers: int,
+) -> Iterator[Tuple[str, List[str]]]:
+    """Yield (label, row) for routed rows, filtered in a process pool.
+
+    Chunks are processed in parallel but yielded in file order.
+    """
+    size = os.path.getsize(path)
+    parts = max(workers, -(-(size - header_end) // _PARALLEL_CHUNK_BYTES))
+    ranges = _chunk_ranges(path, header_end, parts)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            _partition_chunk,
+            itertools.repeat(path),
+            ranges,
+            itertools.repeat(width),
+            itertools.repeat(idx),
+            itertools.repeat(router),
+        )
+        for routed in results:
+            yield from routed
+
+
+def _family_columns(header: List[str], path: str) -> Tuple[int, int, int]:
+    """Positions of the WooCommerce ID, SKU and Parent columns.
+
+    Exports often start with a UTF-8 BOM, which ends up in the first
+    header name ('\\ufeffID'), so it is ignored when looking for 'ID'.
+    """
+    names = [h.lstrip("\ufeff") for h in header]
+    try:
+        return names.index("ID"), names.index("SKU"), names.index("Parent")
+    except ValueError:
+        raise ValueError(
+            f"include_family needs the ID, SKU and Parent columns of a WooCommerce export in {path}"
+        ) from None
+
+
+class ProductFamilies:
+    """Parent/variation links of a WooCommerce export, by row id.
+
+    A variation names its parent in 'Parent', either as 'id:NNNN' (the
+    parent's ID) or by the parent's SKU. root[row] is the row id of the
+    row's parent, or the row itself; children maps a parent row id to its
+    variations' row ids. Built in one pass over the three columns.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str | None],
+        skus: Sequence[str | None],
+        parents: Sequence[str | None],
+    ) -> None:
+        by_id: Dict[str, int] = {}
+        by_sku: Dict[str, int] = {}
+        for i, (row_id, sku) in enumerate(zip(ids, skus)):
+            if row_id:
+                by_id.setdefault(row_id, i)
+            if sku:
+                by_sku.setdefault(sku, i)
+        self.root = array("i", range(len(ids)))
+        self.children: Dict[int, List[int]] = {}
+        for i, ref in enumerate(parents):
+            if not ref:
+                continue
+            if ref.startswith("id:"):
+                parent = by_id.get(ref[3:].strip())
+            else:
+                parent = by_sku.get(ref)
+            if parent is None or parent == i:
+                continue
+            self.root[i] = parent
+            self.children.setdefault(parent, []).append(i)
+
+    @classmethod
+    def from_table(cls, table: Table) -> "ProductFamilies":
+        id_pos, sku_pos, parent_pos = _family_columns(table.header, table.source)
+        return cls(table.columns[id_pos], table.columns[sku_pos], table.columns[parent_pos])
+
+    @classmethod
+    def from_csv(cls, path: str) -> "ProductFamilies":
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            pos = _family_columns(header, path)
+            rows = [[row[i] for i in pos] for row in _data_rows(reader, len(header))]
+        return cls(*zip(*rows)) if rows else cls([], [], [])
+
+    def members(self, row_id: int) -> List[int]:
+        """Row ids of the whole family of row_id: its parent, then the variations."""
+        root = self.root[row_id]
+        return [root] + self.children.get(root, [])
+
+    def expand(
+        self,
+        groups: Dict[str, List[int]],
+        exclusive: str | None = None,
+    ) -> Dict[str, List[int]]:
+        """Grow each label's row ids to whole families, in row order.
+
+        The exclusive label (the 'no match' output of a filter) is not
+        grown; it loses the rows pulled into the other labels instead.
+        """
+        expanded: Dict[str, List[int]] = {}
+        pulled: set = set()
+        for label, ids in groups.items():
+            if label != exclusive:
+                expanded[label] = sorted({m for i in ids for m in self.members(i)})
+                pulled.update(expanded[label])
+        return {
+            label: [i for i in ids if i not in pulled] if label == exclusive else expanded[label]
+            for label, ids in groups.items()
+        }
+
+
+class AttributeStore:
+    """The non-empty 'Attribute N' slots of every row, with interned strings.
+
+    A WooCommerce export repeats a name / value(s) / visible / global
+    column quadruple for every attribute slot, and most of them are empty
+    on most rows. Only non-empty slots are stored, as parallel arrays:
+    slot s has name id slot_names[s], flags slot_flags[s] (1 = visible,
+    2 = global) and value ids value_ids[value_start[s]:value_start[s + 1]];
+    row r owns slots row_start[r]:row_start[r + 1]. names and values hold
+    each distinct string once, so an id is an index into them.
+
+    find() is answered from postings built alongside: the ascending row
+    ids per (name id, value id), per name id and per value id. Built from
+    a file, the store also keeps each row's byte range, so matches are
+    read straight from the CSV (see filter_by_attribute).
+
+    Load the other columns with read_csv(path, other_columns(header)) to
+    keep the attribute columns out of the row dicts.
+    """
+
+    _open: Dict[str, "AttributeStore"] = {}
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.values: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+        self._value_ids: Dict[str, int] = {}
+        self.row_start = array("I", [0])
+        self.slot_names = array("I")
+        self.slot_flags = array("B")
+        self.value_start = array("I", [0])
+        self.value_ids = array("I")
+        self.pair_rows: Dict[Tuple[int, int], array] = {}
+        self.name_rows: Dict[int, array] = {}
+        self.value_rows: Dict[int, array] = {}
+        self.csv_path: str | None = None
+        self.signature: Tuple[int, int] | None = None
+        self.header: List[str] = []
+        self.offsets = array("Q")
+        self.lengths = array("I")
+
+    @staticmethod
+    def other_columns(header: Sequence[str]) -> List[str]:
+        """The columns of header that are not part of an 'Attribute N' slot."""
+        return [h for h in header if not _ATTRIBUTE_COLUMN.fullmatch(h)]
+
+    @classmethod
+    def from_rows(
+        cls,
+        header: Sequence[str],
+        rows: Iterator[Sequence[str | None]],
+    ) -> "AttributeStore":
+        """Build from header plus rows given as field lists."""
+        store = cls()
+        store.header = list(header)
+        slots = _attribute_slots(_field_positions(store.header))
+        for row_id, row in enumerate(rows):
+            keys: set = set()
+            for name_pos, values_pos, visible_pos, global_pos in slots:
+                name = row[name_pos]
+                cell = row[values_pos] if values_pos is not None else None
+                if not name and not cell:
+                    continue
+                flags = (
+                    (1 if visible_pos is not None and row[visible_pos] == "1" else 0)
+                    | (2 if global_pos is not None and row[global_pos] == "1" else 0)
+                )
+                name_id = store._intern(name or "", store.names, store._name_ids)
+                store.slot_names.append(name_id)
+                store.slot_flags.append(flags)
+                if name:
+                    keys.add((name_id, None))
+                for value in split_attribute_values(cell):
+                    value_id = store._intern(value, store.values, store._value_ids)
+                    store.value_ids.append(value_id)
+                    keys.add((name_id, value_id))
+                    keys.add((None, value_id))
+                store.value_start.append(len(store.value_ids))
+            store.row_start.append(len(store.slot_names))
+            for key in keys:
+                store._postings(key).append(row_id)
+        return store
+
+    def _postings(self, key: Tuple[int | None, int | None]) -> array:
+        name_id, value_id = key
+        if value_id is None:
+            postings, key = self.name_rows, name_id
+        elif name_id is None:
+            postings, key = self.value_rows, value_id
+        else:
+            postings = self.pair_rows
+        ids = postings.get(key)
+        if ids is None:
+            ids = postings[key] = array("I")
+        return ids
+
+    @classmethod
+    def from_table(cls, table: Table) -> "AttributeStore":
+        return cls.from_rows(table.header, zip(*table.columns))
+
+    @classmethod
+    def from_csv(cls, path: str) -> "AttributeStore":
+        """Build in one streaming pass over the file, recording row offsets."""
+        st = os.stat(path)
+        records = _iter_offset_records(path)
+        _, _, header = next(records, (0, 0, []))
+        width = len(header)
+        offsets = array("Q")
+        lengths = array("I")
+
+        def rows() -> Iterator[List[str | None]]:
+            for offset, length, fields in records:
+                offsets.append(offset)
+                lengths.append(length)
+                yield fields if len(fields) == width else (fields + [None] * width)[:width]
+
+        store = cls.from_rows(header, rows())
+        store.csv_path = path
+        store.signature = (st.st_size, st.st_mtime_ns)
+        store.offsets = offsets
+        store.lengths = lengths
+        return store
+
+    @classmethod
+    def open(cls, csv_path: str) -> "AttributeStore":
+        """Return the store for csv_path, reusing one already built in this
+        process while the CSV is unchanged."""
+        memo_key = os.path.abspath(csv_path)
+        store = cls._open.get(memo_key)
+        st = os.stat(csv_path)
+        if store is None or store.signature != (st.st_size, st.st_mtime_ns):
+            store = cls._open[memo_key] = cls.from_csv(csv_path)
+        return store
+
+    @staticmethod
+    def _intern(text: str, strings: List[str], ids: Dict[str, int]) -> int:
+        i = ids.get(text)
+        if i is None:
+            i = ids[text] = len(strings)
+            strings.append(text)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.row_start) - 1
+
+    def slots(self, row_id: int) -> List[Tuple[str, List[str], bool, bool]]:
+        """(name, values, visible, global) of each non-empty slot of a row."""
+        result = []
+        for s in range(self.row_start[row_id], self.row_start[row_id + 1]):
+            ids = self.value_ids[self.value_start[s]:self.value_start[s + 1]]
+            flags = self.slot_flags[s]
+            result.append((
+                self.names[self.slot_names[s]],
+                [self.values[v] for v in ids],
+                bool(flags & 1),
+                bool(flags & 2),
+            ))
+        return result
+
+    def attributes(self, row_id: int) -> Dict[str, List[str]]:
+        """A row's attributes as name -> values."""
+        return {name: values for name, values, _, _ in self.slots(row_id)}
+
+    def find(self, name: str | None = None, value: str | None = None) -> List[int]:
+        """Row ids with a slot named name and/or listing value, ascending."""
+        if name is None and value is None:
+            raise ValueError("find needs a name, a value or both")
+        name_id = self._name_ids.get(name) if name is not None else None
+        value_id = self._value_ids.get(value) if value is not None else None
+        if (name is not None and name_id is None) or (value is not None and value_id is None):
+            return []
+        if value_id is None:
+            return list(self.name_rows.get(name_id, ()))
+        if name_id is None:
+            return list(self.value_rows.get(value_id, ()))
+        return list(self.pair_rows.get((name_id, value_id), ()))
+
+    def iter_fields(self, row_ids: Sequence[int]) -> Iterator[List[str]]:
+        """Read and parse the given rows from the CSV, in the order given."""
+        if self.csv_path is None:
+            raise ValueError("AttributeStore was not built from a CSV file")
+        return _read_fields(self.csv_path, self.offsets, self.lengths, len(self.header), row_ids)
+
+
+def _output_path_for(template: str, label: str, used: Dict[str, str]) -> str:
+    """Fill template's {value} with a filename-safe label, avoiding collisions."""
+    safe = re.sub(r"[^\w.-]+", "_", label).strip("_") or "blank"
+    path = template.format(value=safe)
+    n = 1
+    while path in used and used[path] != label:
+        n += 1
+        path = template.format(value=f"{safe}_{n}")
+    used[path] = label
+    return path
+
+
+def _partition_table(
+    table: Table,
+    router: Any,
+    outputs: Dict[str, str | None],
+    output_template: str | None,
+    keep_rows: bool,
+    columns: List[str] | None,
+    include_family: bool = False,
+) -> Tuple[Dict[str, int], Dict[str, Table]]:
+    """_partition for an in-memory Table: labels are computed column-wise."""
+    if not len(table):
+        logger.warning("No rows in file.")
+        return {}, {}
+    groups: Dict[str, List[int]] = {label: [] for label in outputs}
+    multi = getattr(router, "multi", False)
+    for i, routed in enumerate(router.labels(table)):
+        for label in routed if multi else (routed,):
+            if label is not None:
+                groups.setdefault(label, []).append(i)
+    if include_family:
+        exclusive = None if multi else getattr(router, "if_false", None)
+        groups = ProductFamilies.from_table(table).expand(groups, exclusive)
+    if columns is not None:
+        table = table.select(columns)
+
+    used_paths = {path: label for label, path in outputs.items() if path}
+    counts: Dict[str, int] = {}
+    kept: Dict[str, Table] = {}
+    for label, indices in groups.items():
+        counts[label] = len(indices)
+        part = table.take(indices)
+        if label in outputs:
+            path = outputs[label]
+        elif output_template:
+            path = _output_path_for(output_template, label, used_paths)
+        else:
+            path = None
+        if path:
+            part.to_csv(path)
+        if keep_rows:
+            kept[label] = part
+    return counts, kept
+
+
+def partition_rows(
+    file_path: str | Table,
+    column_name: str,
+    route: Callable[[str], str | None],
+    outputs: Dict[str, str | None] | None = None,
+    output_template: str | None = None,
+    keep_rows: bool = True,
+    columns: List[str] | None = None,
+    workers: int = 1,
+) -> Tuple[Dict[str, int], Dict[str, List[Dict[str, str]]]]:
+    """Route every row of file_path to a partition in one streaming pass.
+
+    Only the column_name field is looked at for every row; a dict is built
+    just for rows that are routed to a partition and kept.
+
+    Args:
+        file_path: CSV to read, or an already loaded Table.
+        column_name: Column whose value is passed to route.
+        route: Maps a column value to a partition label, or None to drop the row.
+        outputs: Fixed label -> CSV path; these files are created up front,
+            even if no row lands in them.
+        output_template: Path template with a '{value}' placeholder, used for
+            labels not in outputs; files are opened on the first routed row.
+        keep_rows: If False, rows are only written, not collected in memory.
+        columns: Optional projection for the written and returned rows
+            (default: all columns).
+        workers: If > 1, split the file into byte ranges on record
+            boundaries and route them in a process pool; route must then
+            be picklable. Output order is unchanged. Ignored for a Table.
+
+    Returns:
+        (row counts per label, rows per label). The second dict is empty
+        when keep_rows is False.
+    """
+    return _partition(
+        file_path,
+        _ColumnRouter(column_name, route),
+        outputs,
+        output_template,
+        keep_rows,
+        columns,
+        workers,
+    )
+
+
+def _partition(
+    file_path: str | Table,
+    router: Any,
+    outputs: Dict[str, str | None] | None,
+    output_template: str | None,
+    keep_rows: bool,
+    columns: List[str] | None,
+    workers: int,
+    include_family: bool = False,
+) -> Tuple[Dict[str, int], Dict[str, List[Dict[str, str]]]]:
+    """Engine behind partition_rows and the filters; router labels each row.
+
+    A router with multi = True returns a list of labels, so one row can be
+    written to several outputs. With include_family every routed row
+    brings its whole WooCommerce product family (see ProductFamilies)
+    into the same outputs; it needs a second look at the file, so it cannot
+    be combined with workers > 1.
+    """
+    if include_family and workers > 1:
+        raise ValueError("include_family is not supported with workers > 1")
+    outputs = outputs or {}
+    if isinstance(file_path, Table):
+        return _partition_table(
+            file_path, router, outputs, output_template, keep_rows, columns, include_family
+        )
+    if include_family:
+        return _partition_families(
+            file_path, router, outputs, output_template, keep_rows, columns
+        )
+    counts: Dict[str, int] = {}
+    kept: Dict[str, List[Dict[str, str]]] = {}
+
+    with open(file_path, newline="", encoding="utf-8") as src:
+        reader = csv.reader(src)
+        header = next(reader, [])
+        rows = _data_rows(reader, len(header))
+        first = next(rows, None)
+        if first is None:
+            logger.warning("No rows in file.")
+            return counts, kept
+        positions = _field_positions(header)
+        for col in router.columns():
+            if col not in positions:
+                raise ValueError(f"Column '{col}' not found in {file_path}")
+        router.bind(positions)
+        names, idx = _projection(header, columns, file_path)
+        full_width = idx == list(range(len(header)))
+
+        if workers > 1:
+            header_offset, header_len, _ = next(_iter_offset_records(file_path))
+            header_end = header_offset + header_len
+            routed = _iter_parallel_rows(
+                file_path,
+                header_end,
+                len(header),
+                None if full_width else idx,
+                router,
+                workers,
+            )
+        elif getattr(router, "multi", False):
+            routed = (
+                (label, row if full_width else [row[i] for i in idx])
+                for row in itertools.chain((first,), rows)
+                for label in router(row)
+            )
+        else:
+            routed = (
+                (label, row if full_width else [row[i] for i in idx])
+                for label, row in ((router(r), r) for r in itertools.chain((first,), rows))
+                if label is not None
+            )
+
+        with CsvFanout(names, outputs, output_template) as fanout:
+            if keep_rows:
+                kept = {label: [] for label in outputs}
+                for label, values in routed:
+                    fanout.write(label, values)
+                    if label not in kept:
+                        kept[label] = []
+                    kept[label].append(dict(zip(names, values)))
+            else:
+                for label, values in routed:
+                    fanout.write(label, values)
+        counts = fanout.counts
+
+    return counts, kept
+
+
+def _partition_families(
+    file_path: str,
+    router: Any,
+    outputs: Dict[str, str | None],
+    output_template: str | None,
+    keep_rows: bool,
+    columns: List[str] | None,
+) -> Tuple[Dict[str, int], Dict[str, List[Dict[str, str]]]]:
+    """_partition with include_family for a CSV file.
+
+    One pass routes every row and builds the ProductFamilies links while
+    recording each row's byte range. Family members that did not match
+    themselves are then read back by offset, in file order, instead of
+    scanning the file a second time.
+    """
+    counts: Dict[str, int] = {}
+    kept: Dict[str, List[Dict[str, str]]] = {}
+    records = _iter_offset_records(file_path)
+    header = next(records, (0, 0, []))[2]
+    width = len(header)
+    positions = _field_positions(header)
+    for col in router.columns():
+        if col not in positions:
+            raise ValueError(f"Column '{col}' not found in {file_path}")
+    family_pos = _family_columns(header, file_path)
+    router.bind(positions)
+    names, idx = _projection(header, columns, file_path)
+    multi = getattr(router, "multi", False)
+
+    offsets = array("Q")
+    lengths = array("I")
+    links: List[List[str | None]] = []
+    groups: Dict[str, List[int]] = {label: [] for label in outputs}
+    values: Dict[int, List[str]] = {}
+    for row_id, (offset, length, row) in enumerate(records):
+        if len(row) != width:
+            row = (row + [None] * width)[:width]
+        offsets.append(offset)
+        lengths.append(length)
+        links.append([row[i] for i in family_pos])
+        routed = router(row)
+        for label in routed if multi else (routed,):
+            if label is not None:
+                groups.setdefault(label, []).append(row_id)
+                values[row_id] = [row[i] for i in idx]
+    if not links:
+        logger.warning("No rows in file.")
+        return counts, kept
+
+    families = ProductFamilies(*zip(*links))
+    groups = families.expand(groups, None if multi else getattr(router, "if_false", None))
+    missing = sorted({i for ids in groups.values() for i in ids} - values.keys())
+    with open(file_path, "rb") as src:
+        for row_id in missing:
+            src.seek(offsets[row_id])
+            row = _parse_record(src.read(lengths[row_id]))
+            if len(row) != width:
+                row = (row + [None] * width)[:width]
+            values[row_id] = [row[i] for i in idx]
+
+    with CsvFanout(names, outputs, output_template) as fanout:
+        for label, ids in groups.items():
+            rows = [values[i] for i in ids]
+            fanout.writerows(label, rows)
+            if keep_rows:
+                kept[label] = [dict(zip(names, row)) for row in rows]
+    return fanout.counts, kept
+
+
+def split_csv_by_column(
+    file_path: str | Table,
+    column_name: str,
+    output_template: str = "{value}.csv",
+    columns: List[str] | None = None,
+    workers: int = 1,
+) -> Dict[str, int]:
+    """Write one CSV per distinct value of column_name in a single pass.
+
+    output_template must contain '{value}', which is replaced by a
+    filename-safe form of the column value. Rows are not kept in memory.
+    columns optionally limits the columns written; workers > 1 parses the
+    file in a process pool.
+
+    Returns:
+        Row count per distinct value.
+    """
+    counts, _ = partition_rows(
+        file_path,
+        column_name,
+        _identity,
+        output_template=output_template,
+        keep_rows=False,
+        columns=columns,
+        workers=workers,
+    )
+    logger.info("Split %d rows into %d files by %s", sum(counts.values()), len(counts), column_name)
+    return counts
+
+
+def _no_rows(file_path: str | Table, columns: List[str] | None) -> List[Dict[str, str]] | Table:
+    """Empty filter result: [] for a file, an empty Table for a Table."""
+    if not isinstance(file_path, Table):
+        return []
+    empty = file_path.take([])
+    return empty if columns is None else empty.select(columns)
+
+
+def filter_rows(
+    file_path: str | Table,
+    expr: Expr,
+    output_path: str | None = None,
+    columns: List[str] | None = None,
+    workers: int = 1,
+    include_family: bool = False,
+) -> List[Dict[str, str]] | Table:
+    """Return rows matching a filter expression, in a single scan.
+
+    Example: Regex("Name", r"\\bcuba", re.IGNORECASE) & Eq("Attribute 2 value(s)", "77")
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned,
+            computed from column masks).
+        expr: Expression built from Eq, In, Prefix, Regex, Range, And, Or, Not.
+        output_path: Optional CSV file to write results as they are found.
+        columns: Optional list of columns to keep in the result and export.
+        workers: Number of processes to filter with (1 = no pool); cannot
+            be combined with include_family.
+        include_family: Also return the whole WooCommerce product family
+            (parent and all variations) of every matching row.
+    """
+    _, kept = _partition(
+        file_path,
+        _ExprRouter(expr, "match"),
+        {"match": output_path},
+        None,
+        True,
+        columns,
+        workers,
+        include_family,
+    )
+    if not kept:
+        return _no_rows(file_path, columns)
+    filtered = kept["match"]
+    if output_path:
+        logger.info("Wrote %d rows to %s", len(filtered), output_path)
+    return filtered
+
+
+def filter_rows_batch(
+    file_path: str | Table,
+    queries: Dict[str, Tuple[Expr, str | None]],
+    columns: List[str] | None = None,
+    workers: int = 1,
+    keep_rows: bool = False,
+    include_family: bool = False,
+) -> Tuple[Dict[str, int], Dict[str, List[Dict[str, str]]]]:
+    """Evaluate many named filters in one pass over the file.
+
+    Each row is parsed once and written to the output of every query it
+    matches, so parsing is paid once per file rather than once per query.
+
+    Args:
+        file_path: CSV to read, or a loaded Table.
+        queries: name -> (expression, output CSV path or None). Output
+            files are created even if nothing matches.
+        columns: Optional list of columns to keep in every output.
+        workers: Number of processes to filter with (1 = no pool).
+        keep_rows: Also return the matched rows per query.
+        include_family: Extend every query's matches to whole WooCommerce
+            product families (parent and all variations).
+
+    Returns:
+        (matched row count per query, matched rows per query). The second
+        dict is empty unless keep_rows is True.
+    """
+    counts, kept = _partition(
+        file_path,
+        _BatchRouter({name: expr for name, (expr, _) in queries.items()}),
+        {name: path for name, (_, path) in queries.items()},
+        None,
+        keep_rows,
+        columns,
+        workers,
+        include_family,
+    )
+    for name, (_, path) in queries.items():
+        if path and name in counts:
+            logger.info("Wrote %d rows for '%s' to %s", counts[name], name, path)
+    return counts, kept
 
 
 def filter_rows_by_column(
-    file_path: str,
+    file_path: str | Table,
     column_name: str,
     value: str,
     output_path: str | None = None,
-) -> List[Dict[str, str]]:
-    """Return rows where column_name == value, optionally exporting to CSV."""
-    rows = read_csv(file_path)
+    columns: List[str] | None = None,
+    workers: int = 1,
+    use_index: bool = False,
+    include_family: bool = False,
+    multi_valued: bool = False,
+) -> List[Dict[str, str]] | Table:
+    """Return rows where column_name == value, optionally exporting to CSV.
+
+    file_path may also be a loaded Table, in which case a Table is returned.
+    columns optionally limits the columns kept in the result and export;
+    workers > 1 filters the file in a process pool. use_index=True looks the
+    value up in the column's ColumnIndex (built on first use) instead of
+    scanning the file. include_family=True also returns the whole product
+    family of every match (this always scans the file). multi_valued=True
+    treats the column as a comma-separated list (Tags, Categories,
+    Attribute N value(s)) and matches rows whose list includes value.
+    """
+    if use_index and not include_family and not isinstance(file_path, Table):
+        index = ColumnIndex.open(file_path, column_name, split=multi_valued)
+        return _write_indexed(index, index.equal(value), output_path, columns)
+    return filter_rows(
+        file_path,
+        Contains(column_name, value) if multi_valued else Eq(column_name, value),
+        output_path,
+        columns,
+        workers,
+        include_family,
+    )
+
+def filter_rows_by_column_value(
+    file_path: str | Table,
+    value: str = "77",
+    matched_output: str | None = "attribute2_77.csv",
+    unmatched_output: str | None = "attribute_not_77.csv",
+    columns: List[str] | None = None,
+    workers: int = 1,
+    include_family: bool = False,
+    attribute_name: str | None = None,
+) -> tuple[list[dict[str, str]], list[dict[str, str]]] | tuple[Table, Table]:
+    """Filter by 'Attribute 2 value(s)' == value and export matched + unmatched rows.
+
+    columns optionally limits the columns kept in the results and exports;
+    workers > 1 filters the file in a process pool. include_family=True
+    moves the whole product family of every match into the matched rows.
+    With attribute_name, a row matches when any Attribute N slot with that
+    name lists value (see filter_by_attribute) instead.
+
+    Returns (matched_rows, unmatched_rows); Tables if file_path is a Table.
+    """
+    if attribute_name is None:
+        column_name = "Attribute 2 value(s)"
+        expr: Expr = Eq(column_name, value)
+    else:
+        column_name = f"attribute '{attribute_name}'"
+        expr = Attribute(attribute_name, value)
+
+    _, kept = _partition(
+        file_path,
+        _ExprRouter(expr, "matched", "unmatched"),
+        {"matched": matched_output, "unmatched": unmatched_output},
+        None,
+        True,
+        columns,
+        workers,
+        include_family,
+    )
+    if not kept:
+        return _no_rows(file_path, columns), _no_rows(file_path, columns)
+    matched, unmatched = kept["matched"], kept["unmatched"]
+
+    if matched_output:
+        logger.info("Wrote %d rows with %s='%s' to %s", len(matched), column_name, value, matched_output)
+    if unmatched_output:
+        logger.info(
+            "Wrote %d rows WITHOUT %s='%s' to %s", len(unmatched), column_name, value, unmatched_output
+        )
+    return matched, unmatched
+
+
+def filter_by_attribute(
+    file_path: str | Table,
+    name: str | None = None,
+    value: str | None = None,
+    output_path: str | None = None,
+    columns: List[str] | None = None,
+    include_family: bool = False,
+) -> List[Dict[str, str]] | Table:
+    """Return rows with an Attribute N slot named name that lists value.
+
+    Every slot is searched, so the attribute may sit in any Attribute N
+    block. Either name or value may be left out to match on the other
+    alone. The rows come from the postings of the file's AttributeStore
+    (built on first use, kept for repeat queries) and are read back by
+    byte range, so no row is scanned.
+
+    Example: filter_by_attribute(path, name="Quantity", value="Box of 20 Cigars")
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned).
+        name: Attribute name, e.g. 'Quantity'.
+        value: One of the attribute's values, e.g. 'Box of 20 Cigars'.
+        output_path: Optional CSV file to write results.
+        columns: Optional list of columns to keep in the result and export.
+        include_family: Also return the whole WooCommerce product family
+            of every match (this scans the file with the Attribute
+            expression instead).
+    """
+    if include_family:
+        return filter_rows(
+            file_path, Attribute(name, value), output_path, columns, include_family=True
+        )
+    if name is None and value is None:
+        raise ValueError("filter_by_attribute needs a name, a value or both")
+    if isinstance(file_path, Table):
+        row_ids = AttributeStore.from_table(file_path).find(name, value)
+        return _write_taken(file_path, row_ids, output_path, columns)
+    store = AttributeStore.open(file_path)
+    return _write_indexed(store, store.find(name, value), output_path, columns)
+
+
+def filter_by_category_subtree(
+    file_path: str | Table,
+    category: str,
+    output_path: str | None = None,
+    column_name: str = "Categories",
+    columns: List[str] | None = None,
+    subtree: bool = True,
+) -> List[Dict[str, str]] | Table:
+    """Return rows filed under a category or any of its subcategories.
+
+    category is a path such as 'Cigars' or 'Cigars > Cuban Cigars'. The
+    rows come from the file's CategoryTree (built on first use from the
+    column's split ColumnIndex), so no row is scanned.
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned).
+        category: Category path; spacing around '>' does not matter.
+        output_path: Optional CSV file to write results.
+        column_name: Column holding the category paths (default 'Categories').
+        columns: Optional list of columns to keep in the result and export.
+        subtree: False to only return rows listing exactly this category.
+    """
+    if isinstance(file_path, Table):
+        row_ids = CategoryTree.from_table(file_path, column_name).rows(category, subtree)
+        return _write_taken(file_path, row_ids, output_path, columns)
+    tree = CategoryTree.open(file_path, column_name)
+    index = ColumnIndex.open(file_path, column_name, split=True)
+    return _write_indexed(index, tree.rows(category, subtree), output_path, columns)
+
+
+def category_counts(
+    file_path: str | Table,
+    column_name: str = "Categories",
+    subtree: bool = True,
+) -> Dict[str, int]:
+    """Row count per category path; with subtree, a category counts the
+    rows of all its subcategories too (each row once)."""
+    if isinstance(file_path, Table):
+        return CategoryTree.from_table(file_path, column_name).counts(subtree)
+    return CategoryTree.open(file_path, column_name).counts(subtree)
+
+
+def filter_rows_by_range(
+    file_path: str | Table,
+    column_name: str,
+    low: float | None = None,
+    high: float | None = None,
+    output_path: str | None = None,
+    columns: List[str] | None = None,
+    workers: int = 1,
+    include_family: bool = False,
+) -> List[Dict[str, str]] | Table:
+    """Return rows whose numeric column_name lies in [low, high].
+
+    Either bound may be None. Empty and non-numeric values never match.
+    On a Table the column is parsed once into a NumericColumn and the
+    comparison runs over the array; a file is scanned with Range.
+
+    Example: filter_rows_by_range(table, "Regular price", 10, 25)
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned).
+        column_name: Numeric column, e.g. 'Regular price' or 'Stock'.
+        low: Smallest value to keep, or None.
+        high: Largest value to keep, or None.
+        output_path: Optional CSV file to write results.
+        columns: Optional list of columns to keep in the result and export.
+        workers: Number of processes to filter with (1 = no pool).
+        include_family: Also return the whole WooCommerce product family
+            of every match.
+    """
+    return filter_rows(
+        file_path, Range(column_name, low, high), output_path, columns, workers, include_family
+    )
+
+
+def filter_rows_by_column_prefix(
+    file_path: str | Table,
+    column_name: str,
+    prefix: str,
+    output_path: str | None = None,
+    case_sensitive: bool = True,
+    trim: bool = True,
+    columns: List[str] | None = None,
+    workers: int = 1,
+    use_index: bool = False,
+    include_family: bool = False,
+) -> List[Dict[str, str]] | Table:
+    """Return rows whose column value starts with a prefix.
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned).
+        column_name: Header name to match against.
+        prefix: String prefix to test.
+        output_path: Optional CSV file to write results.
+        case_sensitive: If False, compare using lowercased values/prefix.
+        trim: If True, strip leading/trailing whitespace before comparison.
+        columns: Optional list of columns to keep in the result and export.
+        workers: Number of processes to filter with (1 = no pool).
+        use_index: Answer from the column's ColumnIndex (built on first
+            use) instead of scanning the file.
+        include_family: Also return the whole WooCommerce product family
+            of every match (this always scans the file).
+    """
+    if use_index and not include_family and not isinstance(file_path, Table):
+        index = ColumnIndex.open(file_path, column_name)
+        row_ids = index.prefix(prefix, case_sensitive, trim)
+        return _write_indexed(index, row_ids, output_path, columns)
+    starts = Prefix(column_name, prefix, case_sensitive, trim)
+    return filter_rows(
+        file_path, starts, output_path, columns, workers, include_family
+    )
+
+
+def filter_rows_name_matches_word_prefix(
+    file_path: str | Table,
+    word: str,
+    output_path: str | None = None,
+    column_name: str = "Name",
+    columns: List[str] | None = None,
+    workers: int = 1,
+    use_index: bool = False,
+    include_family: bool = False,
+) -> List[Dict[str, str]] | Table:
+    """Filter rows where some word in column_name starts with word.
+
+    Case-insensitive, on word starts: word="cohiba" matches "Cohiba" and
+    "Cohibas" but not "Xcohiba".
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned).
+        word: Word prefix to look for.
+        output_path: Optional CSV file to write results.
+        column_name: Column to inspect (default 'Name').
+        columns: Optional list of columns to keep in the result and export.
+        workers: Number of processes to filter with (1 = no pool).
+        use_index: Answer with a binary-search range lookup in the column's
+            tokenized ColumnIndex (built on first use, kept loaded for
+            repeat queries) instead of a regex scan. Only for a single-word
+            word; otherwise the file is scanned.
+        include_family: Also return the whole WooCommerce product family
+            of every match (this always scans the file).
+
+    Returns:
+        List of matching row dicts.
+    """
+    if (
+        use_index
+        and not include_family
+        and not isinstance(file_path, Table)
+        and _WORD.fullmatch(word)
+    ):
+        index = ColumnIndex.open(file_path, column_name, tokenized=True)
+        row_ids = index.prefix(word.casefold())
+        return _write_indexed(index, row_ids, output_path, columns)
+
+    # Regex: word boundary then the word followed by zero or more word chars
+    matches = Regex(column_name, rf"\b({re.escape(word)}\w*)\b", re.IGNORECASE)
+    return filter_rows(
+        file_path, matches, output_path, columns, workers, include_family
+    )
+
+
+def filter_rows_name_matches_cuba(
+    file_path: str | Table,
+    output_path: str | None = None,
+    column_name: str = "Name",
+    columns: List[str] | None = None,
+    workers: int = 1,
+    use_index: bool = False,
+    include_family: bool = False,
+) -> List[Dict[str, str]] | Table:
+    """Filter rows whose name contains Cuba variants (cuba/cuban/cubana...).
+
+    Matches case-insensitively on word starts: any token beginning with 'cuba'.
+    Examples that match: "Cuba", "Cuban", "Cubana", "Cubanito".
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned).
+        output_path: Optional CSV file to write results.
+        column_name: Column to inspect (default 'Name').
+        columns: Optional list of columns to keep in the result and export.
+        workers: Number of processes to filter with (1 = no pool).
+        use_index: Use the tokenized ColumnIndex instead of a regex scan.
+        include_family: Also return the whole WooCommerce product family
+            of every match, so variations come with their parent.
+
+    Returns:
+        List of matching row dicts.
+    """
+    return filter_rows_name_matches_word_prefix(
+        file_path,
+        "cuba",
+        output_path,
+        column_name,
+        columns,
+        workers,
+        use_index,
+        include_family,
+    )
+
+
+def tag_rows_by_keywords(
+    file_path: str | Table,
+    keywords: Sequence[str],
+    output_path: str | None = None,
+    column_name: str = "Name",
+    tag_column: str = "Keywords",
+    separator: str = "|",
+    keep_unmatched: bool = False,
+    columns: List[str] | None = None,
+    workers: int = 1,
+    keep_rows: bool = True,
+) -> List[Dict[str, str]] | Table:
+    """Tag each row with the keywords (e.g. brands) found in column_name.
+
+    All keywords are matched in a single pass over each value with a
+    KeywordMatcher, using the same case-insensitive word-start rule as
+    filter_rows_name_matches_word_prefix, so thousands of keywords cost
+    about as much as one.
+
+    Args:
+        file_path: CSV to read, or a loaded Table (a Table is then returned).
+        keywords: Keywords to look for.
+        output_path: Optional CSV file to write the tagged rows.
+        column_name: Column to inspect (default 'Name').
+        tag_column: Name of the added column holding the keywords found.
+        separator: Joins several keywords found in the same row.
+        keep_unmatched: Also return rows without any keyword (empty tag).
+        columns: Optional list of columns to keep besides tag_column.
+        workers: Number of processes to tag with (1 = no pool).
+        keep_rows: Return the tagged rows; set False to only stream them
+            to output_path without holding them in memory.
+
+    Returns:
+        Matching row dicts, each with tag_column added (empty unless
+        keep_rows is True).
+    """
+    router = _KeywordRouter(
+        column_name, KeywordMatcher(keywords), separator, "" if keep_unmatched else None
+    )
+    if isinstance(file_path, Table):
+        tags = router.labels(file_path)
+        table = file_path if columns is None else file_path.select(columns)
+        if tag_column in table.positions:
+            raise ValueError(f"Column '{tag_column}' already exists in {table.source}")
+        tagged = Table(
+            table.header + [tag_column],
+            table.columns + [[tag or "" for tag in tags]],
+            source=table.source,
+        )
+        if not keep_unmatched:
+            tagged = tagged.filter([tag is not None for tag in tags])
+        if not len(file_path):
+            logger.warning("No rows in file.")
+            return tagged
+        if output_path:
+            tagged.to_csv(output_path)
+            logger.info("Wrote %d rows to %s", len(tagged), output_path)
+        return tagged if keep_rows else tagged.take([])
+
+    rows: List[Dict[str, str]] = []
+    with open(file_path, newline="", encoding="utf-8") as src:
+        reader = csv.reader(src)
+        header = next(reader, [])
+        data = _data_rows(reader, len(header))
+        first = next(data, None)
+        if first is None:
+            logger.warning("No rows in file.")
+            return rows
+        positions = _field_positions(header)
+        if column_name not in positions:
+            raise ValueError(f"Column '{column_name}' not found in {file_path}")
+        names, idx = _projection(header, columns, file_path)
+        if tag_column in names:
+            raise ValueError(f"Column '{tag_column}' already exists in {file_path}")
+        router.bind(positions)
+        full_width = idx == list(range(len(header)))
+
+        if workers > 1:
+            header_offset, header_len, _ = next(_iter_offset_records(file_path))
+            tagged = _iter_parallel_rows(
+                file_path,
+                header_offset + header_len,
+                len(header),
+                None if full_width else idx,
+                router,
+                workers,
+            )
+        else:
+            tagged = (
+                (tag, row if full_width else [row[i] for i in idx])
+                for tag, row in ((router(r), r) for r in itertools.chain((first,), data))
+                if tag is not None
+            )
+
+        names = names + [tag_column]
+        with CsvSink(output_path, names) as sink:
+            for tag, values in tagged:
+                values = values + [tag]
+                if keep_rows:
+                    rows.append(dict(zip(names, values)))
+                sink.write(values)
+
+    if output_path:
+        logger.info("Wrote %d rows to %s", sink.count, output_path)
+    return rows
+
+
+def split_rows_by_keywords(
+    file_path: str | Table,
+    keywords: Sequence[str],
+    output_template: str = "{value}.csv",
+    column_name: str = "Name",
+    columns: List[str] | None = None,
+    workers: int = 1,
+    keep_rows: bool = False,
+    include_family: bool = False,
+) -> Tuple[Dict[str, int], Dict[str, List[Dict[str, str]]]]:
+    """Write one CSV per keyword with the rows whose column_name contains it.
+
+    Keywords are matched like in tag_rows_by_keywords, all in one pass; a
+    row containing several keywords is written to each of their files.
+    Files are only created for keywords that occur.
+
+    Args:
+        file_path: CSV to read, or a loaded Table.
+        keywords: Keywords to look for.
+        output_template: Path template; '{value}' is replaced by a
+            filename-safe form of the keyword.
+        column_name: Column to inspect (default 'Name').
+        columns: Optional list of columns to keep in every output.
+        workers: Number of processes to scan with (1 = no pool).
+        keep_rows: Also return the matched rows per keyword.
+        include_family: Write whole WooCommerce product families to every
+            keyword file that one of their rows matches.
+
+    Returns:
+        (row count per keyword found, rows per keyword). The second dict
+        is empty unless keep_rows is True.
+    """
+    counts, kept = _partition(
+        file_path,
+        _KeywordRouter(column_name, KeywordMatcher(keywords)),
+        None,
+        output_template,
+        keep_rows,
+        columns,
+        workers,
+        include_family,
+    )
+    logger.info(
+        "Split %d keyword matches into %d files by %s", sum(counts.values()), len(counts), column_name
+    )
+    return counts, kept
+
+
+class KeyIndex(dict):
+    """Result of index_by_keys: key tuple -> row, or list of rows for keep="all".
+
+    duplicates maps every key that occurs more than once to all of its
+    rows, in file order; it is empty when the keys are unique.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.duplicates: Dict[Tuple[str, ...], List[Mapping]] = {}
+
+
+KEEP_MODES = ("first", "last", "all")
+
+
+def index_by_keys(
+    rows: List[Dict[str, str]] | Table,
+    key_columns: List[str],
+    keep: str = "last",
+) -> KeyIndex:
+    """Build a dict keyed by the tuple of key_columns values.
+
+    keep decides what a duplicated key maps to: its "first" or "last" row
+    (the default), or with "all" the list of all its rows (then every key
+    maps to a list). Duplicate keys are found while indexing and recorded
+    in the result's duplicates.
+
+    For a Table the keys are zipped straight from the key columns and the
+    values are Row views. There the dict is built in one C-level pass and
+    the duplicate groups are only collected when its size shows that some
+    key repeats, so unique keys cost nothing extra.
+    """
+    if keep not in KEEP_MODES:
+        raise ValueError(f"keep must be one of {', '.join(KEEP_MODES)}")
+    if not rows:
+        return KeyIndex()
+
+    if isinstance(rows, Table):
+        for col in key_columns:
+            if col not in rows.positions:
+                raise ValueError(f"Key column '{col}' not found in CSV")
+        keys = list(zip(*(rows.column(col) for col in key_columns)))
+        if keep == "all":
+            index = KeyIndex()
+            for i, key in enumerate(keys):
+                index.setdefault(key, []).append(Row(rows, i))
+            index.duplicates = {k: v for k, v in index.items() if len(v) > 1}
+            return index
+        if keep == "last":
+            index = KeyIndex({key: Row(rows, i) for i, key in enumerate(keys)})
+        else:
+            first = dict(zip(reversed(keys), range(len(keys) - 1, -1, -1)))
+            index = KeyIndex({key: Row(rows, first[key]) for key in dict.fromkeys(keys)})
+        if len(index) < len(keys):
+            groups: Dict[Tuple[str, ...], List[int]] = {}
+            for i, key in enumerate(keys):
+                groups.setdefault(key, []).append(i)
+            index.duplicates = {
+                k: [Row(rows, i) for i in ids] for k, ids in groups.items() if len(ids) > 1
+            }
+        return index
+
+    for col in key_columns:
+        if col not in rows[0]:
+            raise ValueError(f"Key column '{col}' not found in CSV")
+
+    index = KeyIndex()
+    if keep == "all":
+        for r in rows:
+            key = tuple(r.get(col, "") for col in key_columns)
+            group = index.get(key)
+            if group is None:
+                index[key] = [r]
+            else:
+                group.append(r)
+        index.duplicates = {k: g for k, g in index.items() if len(g) > 1}
+        return index
+
+    # A group is only created when a key is seen a second time, seeded with
+    # the row already indexed (still its first row then, for either keep).
+    duplicates: Dict[Tuple[str, ...], List[Dict[str, str]]] = {}
+    for r in rows:
+        key = tuple(r.get(col, "") for col in key_columns)
+        if key not in index:
+            index[key] = r
+            continue
+        group = duplicates.get(key)
+        if group is None:
+            duplicates[key] = [index[key], r]
+        else:
+            group.append(r)
+        if keep == "last":
+            index[key] = r
+    if duplicates:
+        index.duplicates = {k: duplicates[k] for k in index if k in duplicates}
+    return index
+
+
+def _iter_offset_records(path: str) -> Iterator[Tuple[int, int, List[str]]]:
+    """Yield (byte offset, byte length, fields) for every record in a CSV.
+
+    The header is the first record. Blank lines are skipped. Offsets stay
+    correct for quoted fields spanning several lines because csv.reader only
+    pulls the lines it needs to complete each record.
+    """
+    with open(path, "rb") as f:
+        pos = 0
+
+        def lines() -> Iterator[str]:
+            nonlocal pos
+            for raw in f:
+                pos += len(raw)
+                yield raw.decode("utf-8")
+
+        start = 0
+        for fields in csv.reader(lines()):
+            if fields:
+                yield start, pos - start, fields
+            start = pos
+
+
+def _parse_record(data: bytes) -> List[str]:
+    """Parse the raw bytes of a single CSV record into its fields."""
+    return next(csv.reader(io.StringIO(data.decode("utf-8"), newline="")), [])
+
+
+def _read_fields(
+    csv_path: str,
+    offsets: Sequence[int],
+    lengths: Sequence[int],
+    width: int,
+    row_ids: Sequence[int],
+) -> Iterator[List[str]]:
+    """Read the records at the given row ids by byte range, padded to width."""
+    with open(csv_path, "rb") as f:
+        for row_id in row_ids:
+            f.seek(offsets[row_id])
+            fields = _parse_record(f.read(lengths[row_id]))
+            if len(fields) != width:
+                fields = (fields + [None] * width)[:width]
+            yield fields
+
+
+def _key_hash(key: Tuple[str, ...]) -> int:
+    """Stable 64-bit hash of a key tuple (unlike hash(), same across runs)."""
+    data = "\x1f".join("" if v is None else v for v in key).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def row_fingerprint(values: Sequence[str | None], bits: int = 64) -> int:
+    """Stable 64- or 128-bit blake2b fingerprint of a sequence of values.
+
+    Equal fingerprints mean (up to hash collisions) equal values, so rows
+    can be compared or deduplicated by one integer. A missing value (None)
+    fingerprints differently from an empty string.
+    """
+    if bits not in (64, 128):
+        raise ValueError("bits must be 64 or 128")
+    data = "\x1f".join("\x00" if v is None else v for v in values).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=bits // 8).digest(), "little")
+
+
+class CsvRowIndex:
+    """Persistent key -> byte range index for a CSV file, read through mmap.
+
+    The index lives in a '.csvidx' file next to the CSV. It is rebuilt when
+    the CSV's size or mtime, or the key columns, no longer match. Rows are
+    fetched on demand by slicing a memory map of the CSV, so none of them
+    have to stay resident.
+
+    Layout: a fixed header, a JSON block with the key columns, one
+    (offset, length) entry per data row in file order, then one
+    (key hash, row id) entry per row sorted for binary search.
+    """
+
+    MAGIC = b"CSVIDX1\0"
+    _HEADER = struct.Struct("<8sQqQQII")  # magic, size, mtime_ns, rows, header offset/len, json len
+    _ROW = struct.Struct("<QI")
+    _KEY = struct.Struct("<QI")
+
+    def __init__(self, csv_path: str, key_columns: List[str], index_path: str | None = None) -> None:
+        self.csv_path = csv_path
+        self.key_columns = list(key_columns)
+        self.index_path = index_path or csv_path + ".csvidx"
+        if not self._is_current():
+            self.build(csv_path, key_columns, self.index_path)
+
+        self._idx_file = open(self.index_path, "rb")
+        self._idx = mmap.mmap(self._idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self._rows, header_off, header_len, json_len = self._HEADER.unpack_from(self._idx, 0)
+        self._rows_at = self._HEADER.size + json_len
+        self._keys_at = self._rows_at + self._rows * self._ROW.size
+
+        self._src_file = open(csv_path, "rb")
+        self._src = None
+        if os.fstat(self._src_file.fileno()).st_size:
+            self._src = mmap.mmap(self._src_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header: List[str] = []
+        if self._src is not None and header_len:
+            self.header = _parse_record(self._src[header_off:header_off + header_len])
+        self._width = len(self.header)
+        positions = _field_positions(self.header)
+        self._key_pos = [positions[col] for col in self.key_columns if col in positions]
+
+    @classmethod
+    def build(cls, csv_path: str, key_columns: List[str], index_path: str | None = None) -> str:
+        """Scan csv_path once and write its .csvidx file; returns the index path."""
+        index_path = index_path or csv_path + ".csvidx"
+        st = os.stat(csv_path)
+        ranges = bytearray()
+        keys: List[Tuple[int, int]] = []
+        header_off = header_len = 0
+        key_pos: List[int] | None = None
+        width = 0
+        for offset, length, fields in _iter_offset_records(csv_path):
+            if key_pos is None:
+                positions = _field_positions(fields)
+                for col in key_columns:
+                    if col not in positions:
+                        raise ValueError(f"Key column '{col}' not found in CSV")
+                key_pos = [positions[col] for col in key_columns]
+                header_off, header_len, width = offset, length, len(fields)
+                continue
+            if len(fields) < width:
+                fields = fields + [""] * (width - len(fields))
+            key = tuple(fields[i] for i in key_pos)
+            keys.append((_key_hash(key), len(keys)))
+            ranges += cls._ROW.pack(offset, length)
+        keys.sort()
+
+        meta = json.dumps({"key_columns": list(key_columns)}).encode("utf-8")
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls._HEADER.pack(
+                cls.MAGIC, st.st_size, st.st_mtime_ns, len(keys), header_off, header_len, len(meta)
+            ))
+            f.write(meta)
+            f.write(ranges)
+            for h, row_id in keys:
+                f.write(cls._KEY.pack(h, row_id))
+        os.replace(tmp_path, index_path)
+        return index_path
+
+    def _is_current(self) -> bool:
+        try:
+            with open(self.index_path, "rb") as f:
+                head = f.read(self._HEADER.size)
+                magic, size, mtime_ns, _, _, _, json_len = self._HEADER.unpack(head)
+                meta = json.loads(f.read(json_len))
+        except (OSError, struct.error, ValueError):
+            return False
+        st = os.stat(self.csv_path)
+        return (
+            magic == self.MAGIC
+            and size == st.st_size
+            and mtime_ns == st.st_mtime_ns
+            and meta.get("key_columns") == self.key_columns
+        )
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __enter__(self) -> "CsvRowIndex":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._idx.close()
+        self._idx_file.close()
+        if self._src is not None:
+            self._src.close()
+        self._src_file.close()
+
+    def row_range(self, row_id: int) -> Tuple[int, int]:
+        """Return the (byte offset, byte length) of a data row."""
+        if not 0 <= row_id < self._rows:
+            raise IndexError("row id out of range")
+        return self._ROW.unpack_from(self._idx, self._rows_at + row_id * self._ROW.size)
+
+    def raw(self, row_id: int) -> bytes:
+        """Return the raw bytes of a data row, line ending included."""
+        offset, length = self.row_range(row_id)
+        return self._src[offset:offset + length]
+
+    def fields(self, row_id: int) -> List[str]:
+        fields = _parse_record(self.raw(row_id))
+        if len(fields) != self._width:
+            fields = (fields + [None] * self._width)[:self._width]
+        return fields
+
+    def fetch(self, row_id: int) -> Dict[str, str]:
+        """Parse a data row into a dict keyed by header."""
+        return dict(zip(self.header, self.fields(row_id)))
+
+    def row_ids(self, key: Tuple[str, ...]) -> List[int]:
+        """Row ids whose key columns equal key, in file order."""
+        h = _key_hash(key)
+        lo, hi = 0, self._rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._KEY.unpack_from(self._idx, self._keys_at + mid * self._KEY.size)[0] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        found: List[int] = []
+        while lo < self._rows:
+            entry_hash, row_id = self._KEY.unpack_from(self._idx, self._keys_at + lo * self._KEY.size)
+            if entry_hash != h:
+                break
+            fields = self.fields(row_id)
+            # Guard against 64-bit hash collisions
+            if tuple("" if fields[i] is None else fields[i] for i in self._key_pos) == key:
+                found.append(row_id)
+            lo += 1
+        return found
+
+    def get(self, key: Tuple[str, ...], default: Any = None) -> Dict[str, str] | Any:
+        """Return the last row with this key (as index_by_keys does), or default."""
+        ids = self.row_ids(key)
+        return self.fetch(ids[-1]) if ids else default
+
+    def __contains__(self, key: object) -> bool:
+        return bool(self.row_ids(key))  # type: ignore[arg-type]
+
+
+_WORD = re.compile(r"\w+")
+
+
+def _word_tokens(val: str | None) -> set[str]:
+    """Distinct casefolded \\w+ tokens of a value."""
+    return {t.casefold() for t in _WORD.findall(val)} if val else set()
+
+
+def _le_bytes(arr: array) -> bytes:
+    """The contents of an array as little-endian bytes."""
+    if sys.byteorder == "big":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _le_array(typecode: str, f: Any, count: int) -> array:
+    """Read count little-endian items of typecode from f."""
+    arr = array(typecode)
+    data = f.read(count * arr.itemsize)
+    if len(data) != count * arr.itemsize:
+        raise EOFError("truncated index file")
+    arr.frombytes(data)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+class ColumnIndex:
+    """Inverted index on one column: value -> ascending row ids.
+
+    Equality lookups are a dict hit and prefix lookups a bisect over the
+    sorted distinct values, so both cost O(matches) instead of O(file). The
+    byte range of every row is stored too, so matches are read straight
+    from the CSV. The index is saved to a '.colidx' file next to the CSV
+    and rebuilt when the CSV's size or mtime changes.
+
+    Layout: magic, a length-prefixed JSON block (signature, options,
+    header, the distinct values and their posting lengths), then the row
+    offsets, row lengths and all postings as little-endian arrays. Nothing
+    in it is executable, so a planted index file can at worst be rejected.
+
+    With tokenized=True the keys are the casefolded words (\\w+ runs) of
+    each value instead of the whole value ('.tokidx' file), so prefix()
+    answers word-prefix queries such as 'cuba' -> Cuban, Cubana.
+
+    With split=True the keys are the items of a comma-separated list
+    column (see split_attribute_values) instead ('.setidx' file), so
+    equal('Box of 20 Cigars') finds every row whose list includes it.
+    """
+
+    MAGIC = b"COLIDX2\0"
+    _open: Dict[Tuple[str, str, bool, bool], "ColumnIndex"] = {}
+
+    def __init__(
+        self,
+        csv_path: str,
+        column: str,
+        index_path: str | None = None,
+        tokenized: bool = False,
+        split: bool = False,
+    ) -> None:
+        if tokenized and split:
+            raise ValueError("A ColumnIndex is either tokenized or split, not both")
+        self.csv_path = csv_path
+        self.column = column
+        self.tokenized = tokenized
+        self.split = split
+        self.index_path = index_path or self.default_path(csv_path, column, tokenized, split)
+        data = self._load()
+        if data is None:
+            data = self.build(csv_path, column, self.index_path, tokenized, split)
+        self.signature = data["signature"]
+        self.header: List[str] = data["header"]
+        self.postings: Dict[str, array] = data["postings"]
+        self.sorted_values: List[str] = data["sorted_values"]
+        self.offsets: array = data["offsets"]
+        self.lengths: array = data["lengths"]
+        self._normalized: Dict[Tuple[bool, bool], List[Tuple[str, str]]] = {}
+
+    @classmethod
+    def open(
+        cls,
+        csv_path: str,
+        column: str,
+        tokenized: bool = False,
+        split: bool = False,
+    ) -> "ColumnIndex":
+        """Return an index for csv_path/column, reusing one already loaded
+        in this process while the CSV is unchanged."""
+        memo_key = (os.path.abspath(csv_path), column, tokenized, split)
+        index = cls._open.get(memo_key)
+        st = os.stat(csv_path)
+        if index is None or index.signature != (st.st_size, st.st_mtime_ns):
+            index = cls._open[memo_key] = cls(
+                csv_path, column, tokenized=tokenized, split=split
+            )
+        return index
+
+    @staticmethod
+    def default_path(
+        csv_path: str,
+        column: str,
+        tokenized: bool = False,
+        split: bool = False,
+    ) -> str:
+        safe = re.sub(r"[^\w.-]+", "_", column)
+        kind = "tokidx" if tokenized else "setidx" if split else "colidx"
+        return f"{csv_path}.{safe}.{kind}"
+
+    @classmethod
+    def build(
+        cls,
+        csv_path: str,
+        column: str,
+        index_path: str | None = None,
+        tokenized: bool = False,
+        split: bool = False,
+    ) -> Dict[str, Any]:
+        """Scan csv_path once, write the index file and return its contents."""
+        index_path = index_path or cls.default_path(csv_path, column, tokenized, split)
+        if tokenized:
+            keys_of: Callable[[str | None], Any] = _word_tokens
+        elif split:
+            keys_of = lambda value: set(split_attribute_values(value))
+        else:
+            keys_of = lambda value: (value,)
+        st = os.stat(csv_path)
+        header: List[str] = []
+        pos = -1
+        postings: Dict[str, array] = {}
+        offsets = array("Q")
+        lengths = array("I")
+        for offset, length, fields in _iter_offset_records(csv_path):
+            if pos < 0:
+                header = fields
+                positions = _field_positions(header)
+                if column not in positions:
+                    raise ValueError(f"Column '{column}' not found in {csv_path}")
+                pos = positions[column]
+                continue
+            value = fields[pos] if pos < len(fields) else None
+            row_id = len(offsets)
+            for key in keys_of(value):
+                ids = postings.get(key)
+                if ids is None:
+                    ids = postings[key] = array("I")
+                ids.append(row_id)
+            offsets.append(offset)
+            lengths.append(length)
+
+        meta = {
+            "signature": [st.st_size, st.st_mtime_ns],
+            "column": column,
+            "tokenized": tokenized,
+            "split": split,
+            "header": header,
+            "rows": len(offsets),
+            "values": list(postings),
+            "counts": [len(ids) for ids in postings.values()],
+        }
+        blob = json.dumps(meta).encode("utf-8")
+        tmp = index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack("<I", len(blob)))
+            f.write(blob)
+            for arr in itertools.chain((offsets, lengths), postings.values()):
+                f.write(_le_bytes(arr))
+        os.replace(tmp, index_path)
+        return cls._data(meta, postings, offsets, lengths)
+
+    @staticmethod
+    def _data(
+        meta: Dict[str, Any],
+        postings: Dict[str | None, array],
+        offsets: array,
+        lengths: array,
+    ) -> Dict[str, Any]:
+        return {
+            "signature": tuple(meta["signature"]),
+            "header": meta["header"],
+            "postings": postings,
+            "sorted_values": sorted(v for v in postings if v is not None),
+            "offsets": offsets,
+            "lengths": lengths,
+        }
+
+    def _load(self) -> Dict[str, Any] | None:
+        st = os.stat(self.csv_path)
+        try:
+            with open(self.index_path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    return None
+                (meta_len,) = struct.unpack("<I", f.read(4))
+                meta = json.loads(f.read(meta_len))
+                if (
+                    not isinstance(meta, dict)
+                    or meta.get("column") != self.column
+                    or meta.get("tokenized") != self.tokenized
+                    or meta.get("split") != self.split
+                    or meta.get("signature") != [st.st_size, st.st_mtime_ns]
+                ):
+                    return None
+                offsets = _le_array("Q", f, meta["rows"])
+                lengths = _le_array("I", f, meta["rows"])
+                postings = {
+                    value: _le_array("I", f, count)
+                    for value, count in zip(meta["values"], meta["counts"])
+                }
+        except (OSError, ValueError, KeyError, TypeError, EOFError, struct.error):
+            return None
+        return self._data(meta, postings, offsets, lengths)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def equal(self, value: str) -> List[int]:
+        """Row ids whose column value == value."""
+        return list(self.postings.get(value, ()))
+
+    def prefix(self, prefix: str, case_sensitive: bool = True, trim: bool = False) -> List[int]:
+        """Row ids whose column value starts with prefix, in file order.
+
+        Costs a bisect plus O(matches): the sorted values are walked from
+        the first candidate until one no longer starts with prefix.
+        """
+        ids: List[int] = []
+        if case_sensitive and not trim:
+            values = self.sorted_values
+            i = bisect.bisect_left(values, prefix)
+            while i < len(values) and values[i].startswith(prefix):
+                ids.extend(self.postings[values[i]])
+                i += 1
+        else:
+            if not case_sensitive:
+                prefix = prefix.lower()
+            keyed = self._normalized_values(case_sensitive, trim)
+            i = bisect.bisect_left(keyed, (prefix,))
+            while i < len(keyed) and keyed[i][0].startswith(prefix):
+                ids.extend(self.postings[keyed[i][1]])
+                i += 1
+        if self.tokenized or self.split:
+            # A row can hold several tokens or items with the same prefix
+            return sorted(set(ids))
+        ids.sort()
+        return ids
+
+    def _normalized_values(self, case_sensitive: bool, trim: bool) -> List[Tuple[str, str]]:
+        """(normalized value, value) pairs, sorted; built once per option pair."""
+        key = (case_sensitive, trim)
+        if key not in self._normalized:
+            pairs = []
+            for value in self.sorted_values:
+                norm = value.strip() if trim else value
+                pairs.append((norm if case_sensitive else norm.lower(), value))
+            pairs.sort()
+            self._normalized[key] = pairs
+        return self._normalized[key]
+
+    def iter_fields(self, row_ids: Sequence[int]) -> Iterator[List[str]]:
+        """Read and parse the given rows from the CSV, in the order given."""
+        return _read_fields(self.csv_path, self.offsets, self.lengths, len(self.header), row_ids)
+
+
+class ValueSets:
+    """In-memory view of a comma-separated list column as interned value sets.
+
+    Each distinct set of values is stored once (sets[i]) and every row
+    holds the id of its set in row_sets, so the thousands of rows sharing
+    'Single Cigar, 5 Cigars, Box of 20 Cigars' share one frozenset.
+    postings maps each value to the ascending ids of the rows listing it.
+    Row ids are positions in the Table or file the view was built from,
+    so table.take(view.rows(value)) gives the matching rows.
+    """
 
-    if not rows:
-        print("No rows in file.")
-        return []
+    def __init__(self, cells: Iterator[str | None]) -> None:
+        self.sets: List[frozenset] = []
+        self.row_sets = array("I")
+        self.postings: Dict[str, array] = {}
+        set_ids: Dict[str | None, int] = {}
+        for row_id, cell in enumerate(cells):
+            set_id = set_ids.get(cell)
+            if set_id is None:
+                set_id = set_ids[cell] = len(self.sets)
+                self.sets.append(frozenset(split_attribute_values(cell)))
+            self.row_sets.append(set_id)
+            for value in self.sets[set_id]:
+                ids = self.postings.get(value)
+                if ids is None:
+                    ids = self.postings[value] = array("I")
+                ids.append(row_id)
 
-    if column_name not in rows[0]:
-        raise ValueError(f"Column '{column_name}' not found in {file_path}")
+    @classmethod
+    def from_table(cls, table: Table, column: str) -> "ValueSets":
+        return cls(iter(table.column(column)))
 
-    filtered = [r for r in rows if r.get(column_name) == value]
+    @classmethod
+    def from_csv(cls, path: str, column: str) -> "ValueSets":
+        """Build in one streaming pass over one column of the file."""
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            _, (pos,) = _projection(header, [column], path)
+            return cls(row[pos] for row in _data_rows(reader, len(header)))
 
-    if output_path:
-        with open(output_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-            writer.writeheader()
-            writer.writerows(filtered)
-        print(f"Wrote {len(filtered)} rows to {output_path}")
+    def __len__(self) -> int:
+        return len(self.row_sets)
 
-    return filtered
+    def values(self, row_id: int) -> frozenset:
+        """The set of values listed by a row."""
+        return self.sets[self.row_sets[row_id]]
 
-def filter_rows_by_column_value(
-    file_path: str,
-    value: str = "77",
-    matched_output: str | None = "attribute2_77.csv",
-    unmatched_output: str | None = "attribute_not_77.csv",
-) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
-    """Filter by 'Attribute 2 value(s)' == value and export matched + unmatched rows.
+    def rows(self, value: str) -> List[int]:
+        """Row ids whose list includes value."""
+        return list(self.postings.get(value, ()))
 
-    Returns (matched_rows, unmatched_rows)
-    """
-    column_name = "Attribute 2 value(s)"
-    rows = read_csv(file_path)
+    def rows_any(self, values: Sequence[str]) -> List[int]:
+        """Row ids whose list includes at least one of values, ascending."""
+        return sorted({r for v in values for r in self.postings.get(v, ())})
 
-    if not rows:
-        print("No rows in file")
-        return [], []
-    
-    if column_name not in rows[0]:
-        raise ValueError(f"Column '{column_name}' not found in {file_path}")
-    
-    matched = [r for r in rows if r.get(column_name) == value]
-    unmatched = [r for r in rows if r.get(column_name) != value]
+    def rows_all(self, values: Sequence[str]) -> List[int]:
+        """Row ids whose list includes every one of values, ascending."""
+        lists = sorted((self.postings.get(v, array("I")) for v in values), key=len)
+        if not lists:
+            return []
+        found = set(lists[0])
+        for ids in lists[1:]:
+            found.intersection_update(ids)
+        return sorted(found)
 
-    if matched_output:
-        with open(matched_output, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-            writer.writeheader()
-            writer.writerows(matched)
-        print(f"Wrote {len(matched)} rows with {column_name}='{value}' to {matched_output}")
-    
-    if unmatched_output:
-        with open(unmatched_output, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-            writer.writeheader()
-            writer.writerows(unmatched)
-        print(f"Wrote {len(unmatched)} rows WITHOUT {column_name}='{value}' to {unmatched_output}")
-    return matched, unmatched
+    def counts(self) -> Dict[str, int]:
+        """Number of rows listing each value, most common first."""
+        return dict(
+            sorted(((v, len(ids)) for v, ids in self.postings.items()), key=lambda kv: -kv[1])
+        )
 
 
-def filter_rows_by_column_prefix(
-    file_path: str,
-    column_name: str,
-    prefix: str,
-    output_path: str | None = None,
-    case_sensitive: bool = True,
-    trim: bool = True,
-) -> List[Dict[str, str]]:
-    """Return rows whose column value starts with a prefix.
+def _category_path(path: str) -> str:
+    """Normalize a 'Cigars >Cuban Cigars' category path to 'Cigars > Cuban Cigars'."""
+    return " > ".join(part.strip() for part in path.split(">") if part.strip())
 
-    Args:
-        file_path: CSV to read.
-        column_name: Header name to match against.
-        prefix: String prefix to test.
-        output_path: Optional CSV file to write results.
-        case_sensitive: If False, compare using lowercased values/prefix.
-        trim: If True, strip leading/trailing whitespace before comparison.
+
+class CategoryTree:
+    """WooCommerce category hierarchy with the rows filed under each node.
+
+    A Categories cell lists one or more paths ('Cigars, Cigars > Cuban
+    Cigars'), each level separated by '>'. Node ids index paths[] (the
+    normalized full path) and parent[] (-1 for a top-level category);
+    postings[node] holds the ascending ids of the rows that list that exact
+    path. rows() unions a node's postings with its descendants', once per
+    node, so a subtree query costs O(matches) instead of a scan.
     """
-    rows = read_csv(file_path)
-    if not rows:
-        print("No rows in file.")
-        return []
-    if column_name not in rows[0]:
-        raise ValueError(f"Column '{column_name}' not found in {file_path}")
-
-    if not case_sensitive:
-        prefix_cmp = prefix.lower()
-        def starts(val: str) -> bool:
-            if trim:
-                val = val.strip()
-            return val.lower().startswith(prefix_cmp)
-    else:
-        prefix_cmp = prefix
-        def starts(val: str) -> bool:
-            if trim:
-                val = val.strip()
-            return val.startswith(prefix_cmp)
 
-    filtered = [r for r in rows if starts(r.get(column_name, ""))]
+    _open: Dict[Tuple[str, str], Tuple[ColumnIndex, "CategoryTree"]] = {}
 
-    if output_path:
-        with open(output_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-            writer.writeheader()
-            writer.writerows(filtered)
-        print(f"Wrote {len(filtered)} rows to {output_path}")
+    def __init__(self, postings: Mapping[str, Sequence[int]]) -> None:
+        self.paths: List[str] = []
+        self.parent = array("i")
+        self.children: Dict[int, List[int]] = {}
+        self.postings: List[array] = []
+        self._ids: Dict[str, int] = {}
+        self._subtree: Dict[int, array] = {}
+        merged: Dict[int, set] = {}
+        for path, row_ids in postings.items():
+            if path is None:
+                continue
+            node = self._node(_category_path(path))
+            if node is not None:
+                merged.setdefault(node, set()).update(row_ids)
+        for node, row_ids in merged.items():
+            self.postings[node] = array("I", sorted(row_ids))
 
-    return filtered
+    def _node(self, path: str) -> int | None:
+        """Id of the node for a normalized path, adding it and its ancestors."""
+        if not path:
+            return None
+        node = self._ids.get(path)
+        if node is None:
+            head, sep, _ = path.rpartition(" > ")
+            parent = self._node(head) if sep else None
+            node = self._ids[path] = len(self.paths)
+            self.paths.append(path)
+            self.parent.append(-1 if parent is None else parent)
+            self.postings.append(array("I"))
+            if parent is not None:
+                self.children.setdefault(parent, []).append(node)
+        return node
 
+    @classmethod
+    def from_table(cls, table: Table, column: str = "Categories") -> "CategoryTree":
+        return cls(ValueSets.from_table(table, column).postings)
 
-def filter_rows_name_matches_cuba(
-    file_path: str,
-    output_path: str | None = None,
-    column_name: str = "Name",
-) -> List[Dict[str, str]]:
-    """Filter rows whose name contains Cuba variants (cuba/cuban/cubana...).
+    @classmethod
+    def open(cls, csv_path: str, column: str = "Categories") -> "CategoryTree":
+        """Return the tree for csv_path, built from the column's split
+        ColumnIndex and reused while that index is current."""
+        index = ColumnIndex.open(csv_path, column, split=True)
+        memo_key = (os.path.abspath(csv_path), column)
+        cached = cls._open.get(memo_key)
+        if cached is None or cached[0] is not index:
+            cached = cls._open[memo_key] = (index, cls(index.postings))
+        return cached[1]
 
-    Matches case-insensitively on word starts: any token beginning with 'cuba'.
-    Examples that match: "Cuba", "Cuban", "Cubana", "Cubanito".
+    def __contains__(self, path: object) -> bool:
+        return isinstance(path, str) and _category_path(path) in self._ids
 
-    Args:
-        file_path: CSV to read.
-        output_path: Optional CSV file to write results.
-        column_name: Column to inspect (default 'Name').
+    def roots(self) -> List[str]:
+        """Top-level category paths."""
+        return [p for p, parent in zip(self.paths, self.parent) if parent < 0]
 
-    Returns:
-        List of matching row dicts.
-    """
+    def subcategories(self, path: str) -> List[str]:
+        """Full paths of the direct children of a category."""
+        node = self._ids.get(_category_path(path))
+        return [self.paths[c] for c in self.children.get(node, [])] if node is not None else []
 
-    rows = read_csv(file_path)
-    if not rows:
-        print("No rows in file.")
-        return []
-    if column_name not in rows[0]:
-        raise ValueError(f"Column '{column_name}' not found in {file_path}")
+    def _subtree_rows(self, node: int) -> array:
+        rows = self._subtree.get(node)
+        if rows is None:
+            kids = self.children.get(node)
+            if not kids:
+                rows = self.postings[node]
+            else:
+                merged = set(self.postings[node])
+                for child in kids:
+                    merged.update(self._subtree_rows(child))
+                rows = array("I", sorted(merged))
+            self._subtree[node] = rows
+        return rows
 
-    # Regex: word boundary then 'cuba' followed by zero or more word chars
-    # Case-insensitive. This captures cuba, cuban, cubana, etc.
-    pattern = re.compile(r"\b(cuba\w*)\b", re.IGNORECASE)
+    def rows(self, path: str, subtree: bool = True) -> List[int]:
+        """Ascending row ids filed under path, or under it or any descendant."""
+        node = self._ids.get(_category_path(path))
+        if node is None:
+            return []
+        return list(self._subtree_rows(node) if subtree else self.postings[node])
 
-    def matches(val: str) -> bool:
-        if not val:
-            return False
-        return pattern.search(val) is not None
+    def counts(self, subtree: bool = True) -> Dict[str, int]:
+        """Row count per category path, in first-seen order."""
+        if subtree:
+            return {p: len(self._subtree_rows(n)) for n, p in enumerate(self.paths)}
+        return {p: len(ids) for p, ids in zip(self.paths, self.postings)}
 
-    filtered = [r for r in rows if matches(r.get(column_name, ""))]
 
-    if output_path:
-        with open(output_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-            writer.writeheader()
-            writer.writerows(filtered)
-        print(f"Wrote {len(filtered)} rows to {output_path}")
+def _write_indexed(
+    index: "ColumnIndex | AttributeStore",
+    row_ids: Sequence[int],
+    output_path: str | None,
+    columns: List[str] | None,
+) -> List[Dict[str, str]]:
+    """Fetch row_ids through an index, export them and return them as dicts.
 
-    return filtered
+    index is anything with header, csv_path, offsets and iter_fields(row_ids).
+    """
+    if not len(index.offsets):
+        # Same as a scan of a header-only file: warn, create no output
+        logger.warning("No rows in file.")
+        return []
+    names, idx = _projection(index.header, columns, index.csv_path)
+    rows = [[fields[i] for i in idx] for fields in index.iter_fields(row_ids)]
+    if output_path:
+        with CsvSink(output_path, names) as sink:
+            sink.writerows(rows)
+        logger.info("Wrote %d rows to %s", len(rows), output_path)
+    return [dict(zip(names, row)) for row in rows]
 
 
-def index_by_keys(
-    rows: List[Dict[str, str]],
-    key_columns: List[str],
-) -> Dict[Tuple[str, ...], Dict[str, str]]:
-    """Build a dict keyed by the tuple of key_columns values."""
-    if not rows:
-        return {}
+def _write_taken(
+    table: Table,
+    row_ids: Sequence[int],
+    output_path: str | None,
+    columns: List[str] | None,
+) -> Table:
+    """The Table counterpart of _write_indexed: take, project and export rows."""
+    result = table.take(row_ids)
+    if columns is not None:
+        result = result.select(columns)
+    if output_path:
+        result.to_csv(output_path)
+        logger.info("Wrote %d rows to %s", len(result), output_path)
+    return result
 
-    for col in key_columns:
-        if col not in rows[0]:
-            raise ValueError(f"Key column '{col}' not found in CSV")
 
-    index: Dict[Tuple[str, ...], Dict[str, str]] = {}
-    for r in rows:
-        key = tuple(r.get(col, "") for col in key_columns)
-        index[key] = r
-    return index
+COMPARE_ORDERS = ("sorted", "file1", "file2", "unordered")
 
 
 def compare_csv_by_keys(
@@ -201,22 +3318,240 @@ def compare_csv_by_keys(
     diff_output_path: str | None = "differences.csv",
     only_in_1_output: str | None = "only_in_file1.csv",
     only_in_2_output: str | None = "only_in_file2.csv",
-) -> None:
+    external: bool = False,
+    chunk_rows: int = 100_000,
+    use_row_index: bool = False,
+    workers: int = 1,
+    log_rows: int | None = None,
+    summary_path: str | None = None,
+    fingerprint_column: str | None = None,
+    fingerprint_bits: int = 64,
+    order: str = "sorted",
+    keep: str = "last",
+    duplicates_output: str | None = None,
+    numeric_columns: Sequence[str] | None = None,
+    tolerance: float = 0.0,
+) -> Dict[str, Any] | None:
     """Compare two CSVs by key columns and optionally export CSV reports.
 
     - diff_output_path: rows (per key+column) where compare_columns differ
     - only_in_1_output: rows that exist only in file1
     - only_in_2_output: rows that exist only in file2
+
+    With external=True both files are sorted by key in chunks of chunk_rows
+    rows spilled to temp files and then merged in one streaming pass, so
+    memory stays bounded regardless of file size. The exported CSVs are the
+    same as in the default in-memory mode; only per-row logging is skipped.
+
+    With use_row_index=True only the key and compare columns are loaded, and
+    the full rows needed for the only-in reports are fetched by byte offset
+    through each file's CsvRowIndex (.csvidx, built once and reused).
+
+    With workers > 1 both files are hash-partitioned by key into one bucket
+    pair per worker, each pair is diffed in its own process, and the sorted
+    results are merged, again with count-only logging.
+
+    Report lines go to the module logger at INFO. In the in-memory mode
+    every only-in row and every difference is logged; log_rows limits that
+    to the first log_rows per section, followed by a count of the rest.
+
+    In the in-memory mode the compare_columns of every row are gathered
+    into one tuple up front, and column values are only compared one by
+    one for keys whose tuples differ. fingerprint_column adds a stable
+    row_fingerprint of the compare columns (hex, fingerprint_bits wide) as
+    a last column of the only-in exports, for downstream deduplication; it
+    is not supported with external or workers.
+
+    order sets the row order of the reports and logged lines:
+    - "sorted": by key (the default)
+    - "file1": only-in-file2 rows in file2 order, everything else in
+      file1 order
+    - "file2": only-in-file1 rows in file1 order, everything else in
+      file2 order
+    - "unordered": whatever is cheapest; no sort at all
+    A duplicated key sits at its first occurrence in the file orders,
+    which are only available in the in-memory mode. external
+    always yields key order, and with workers "unordered" writes each
+    bucket's results as they are instead of merging them by key.
+
+    A key that occurs several times in one file is compared using its
+    last row, or its first with keep="first". The in-memory mode reports
+    such keys: a warning per file, the counts in the summary, and with
+    duplicates_output a CSV with one row per duplicated key and file
+    (file, key columns, count). external and workers always keep the last
+    row and do not report duplicates.
+
+    Compare columns named in numeric_columns (e.g. the keys of
+    WOOCOMMERCE_NUMERIC_COLUMNS) are compared as numbers when their text
+    differs: "12.50" equals "12.5", and with tolerance values at most
+    tolerance apart are equal too. A value that does not parse still
+    differs from any other text.
+
+    Returns:
+        A summary dict (counts, differences per column, created outputs,
+        elapsed seconds), also written as JSON to summary_path if given;
+        None if either file has no data.
+    """
+    if fingerprint_column and (external or workers > 1):
+        raise ValueError("fingerprint_column is only supported by the in-memory compare")
+    if order not in COMPARE_ORDERS:
+        raise ValueError(f"order must be one of {', '.join(COMPARE_ORDERS)}")
+    if order in ("file1", "file2") and (external or workers > 1):
+        raise ValueError(f"order='{order}' is only supported by the in-memory compare")
+    if keep not in ("first", "last"):
+        raise ValueError("keep must be 'first' or 'last' for a compare")
+    if (keep != "last" or duplicates_output) and (external or workers > 1):
+        raise ValueError("keep and duplicates_output are only supported by the in-memory compare")
+    numeric = [col in set(numeric_columns or ()) for col in compare_columns]
+    duplicate_keys: Dict[str, int] | None = None
+    started = time.perf_counter()
+    if workers > 1:
+        mode = "partitioned"
+        result = _compare_csv_partitioned(
+            file1,
+            file2,
+            key_columns,
+            compare_columns,
+            diff_output_path,
+            only_in_1_output,
+            only_in_2_output,
+            workers,
+            order,
+            numeric,
+            tolerance,
+        )
+    elif external:
+        mode = "external"
+        result = _compare_csv_external(
+            file1,
+            file2,
+            key_columns,
+            compare_columns,
+            diff_output_path,
+            only_in_1_output,
+            only_in_2_output,
+            chunk_rows,
+            numeric,
+            tolerance,
+        )
+    else:
+        mode = "in_memory"
+        duplicate_keys = {}
+        result = _compare_csv_in_memory(
+            file1,
+            file2,
+            key_columns,
+            compare_columns,
+            diff_output_path,
+            only_in_1_output,
+            only_in_2_output,
+            use_row_index,
+            log_rows,
+            fingerprint_column,
+            fingerprint_bits,
+            order,
+            keep,
+            duplicates_output,
+            duplicate_keys,
+            numeric,
+            tolerance,
+        )
+    if result is None:
+        return None
+    return _compare_summary(
+        file1,
+        file2,
+        key_columns,
+        compare_columns,
+        mode,
+        result,
+        diff_output_path,
+        only_in_1_output,
+        only_in_2_output,
+        started,
+        summary_path,
+        duplicate_keys,
+    )
+
+
+def _compare_summary(
+    file1: str,
+    file2: str,
+    key_columns: List[str],
+    compare_columns: List[str],
+    mode: str,
+    result: Tuple[int, int, Dict[str, int]],
+    diff_output_path: str | None,
+    only_in_1_output: str | None,
+    only_in_2_output: str | None,
+    started: float,
+    summary_path: str | None,
+    duplicate_keys: Dict[str, int] | None = None,
+) -> Dict[str, Any]:
+    """Build the summary returned by the compares, writing it to summary_path."""
+    only1, only2, by_column = result
+    differences = sum(by_column.values())
+    summary = {
+        "file1": file1,
+        "file2": file2,
+        "key_columns": key_columns,
+        "compare_columns": compare_columns,
+        "mode": mode,
+        "only_in_file1": only1,
+        "only_in_file2": only2,
+        "differences": differences,
+        "differences_by_column": by_column,
+        "outputs": {
+            "differences": diff_output_path if differences else None,
+            "only_in_file1": only_in_1_output if only1 else None,
+            "only_in_file2": only_in_2_output if only2 else None,
+        },
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if duplicate_keys is not None:
+        summary["duplicate_keys"] = duplicate_keys
+    if summary_path:
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        logger.info("Wrote summary to %s", summary_path)
+    return summary
+
+
+def _compare_csv_in_memory(
+    file1: str,
+    file2: str,
+    key_columns: List[str],
+    compare_columns: List[str],
+    diff_output_path: str | None,
+    only_in_1_output: str | None,
+    only_in_2_output: str | None,
+    use_row_index: bool,
+    log_rows: int | None,
+    fingerprint_column: str | None,
+    fingerprint_bits: int,
+    order: str,
+    keep: str,
+    duplicates_output: str | None,
+    duplicate_keys: Dict[str, int],
+    numeric: Sequence[bool] | None = None,
+    tolerance: float = 0.0,
+) -> Tuple[int, int, Dict[str, int]] | None:
+    """Default compare: both files loaded as Tables and indexed by key.
+
+    Fills duplicate_keys with the number of duplicated keys per file.
     """
-    rows1 = read_csv(file1)
-    rows2 = read_csv(file2)
+    projection = None
+    if use_row_index:
+        projection = list(dict.fromkeys(key_columns + compare_columns))
+    rows1 = Table.from_csv(file1, columns=projection)
+    rows2 = Table.from_csv(file2, columns=projection)
 
     if not rows1:
-        print(f"{file1} has no data.")
-        return
+        logger.warning("%s has no data.", file1)
+        return None
     if not rows2:
-        print(f"{file2} has no data.")
-        return
+        logger.warning("%s has no data.", file2)
+        return None
 
     # Validate compare columns
     for col in compare_columns:
@@ -225,82 +3560,948 @@ def compare_csv_by_keys(
         if col not in rows2[0]:
             raise ValueError(f"Column '{col}' not found in {file2}")
 
-    idx1 = index_by_keys(rows1, key_columns)
-    idx2 = index_by_keys(rows2, key_columns)
+    idx1 = index_by_keys(rows1, key_columns, keep)
+    idx2 = index_by_keys(rows2, key_columns, keep)
+    _report_duplicates(
+        {"file1": idx1.duplicates, "file2": idx2.duplicates},
+        {"file1": file1, "file2": file2},
+        key_columns,
+        keep,
+        duplicates_output,
+    )
+    duplicate_keys["file1"] = len(idx1.duplicates)
+    duplicate_keys["file2"] = len(idx2.duplicates)
+    compare_values = (
+        _compare_values_by_key(rows1, key_columns, compare_columns, keep),
+        _compare_values_by_key(rows2, key_columns, compare_columns, keep),
+    )
+
+    with contextlib.ExitStack() as stack:
+        if use_row_index:
+            ri1 = stack.enter_context(CsvRowIndex(file1, key_columns))
+            ri2 = stack.enter_context(CsvRowIndex(file2, key_columns))
+            pick = 0 if keep == "first" else -1
+            full1 = lambda k: ri1.fetch(ri1.row_ids(k)[pick])
+            full2 = lambda k: ri2.fetch(ri2.row_ids(k)[pick])
+            fields1 = list(dict.fromkeys(ri1.header))
+            fields2 = list(dict.fromkeys(ri2.header))
+        else:
+            full1, fields1 = idx1.get, list(rows1[0].keys())
+            full2, fields2 = idx2.get, list(rows2[0].keys())
+        return _report_by_index(
+            idx1,
+            idx2,
+            key_columns,
+            compare_columns,
+            diff_output_path,
+            only_in_1_output,
+            only_in_2_output,
+            full1,
+            full2,
+            fields1,
+            fields2,
+            log_rows,
+            compare_values,
+            fingerprint_column,
+            fingerprint_bits,
+            order,
+            numeric,
+            tolerance,
+        )
+
+
+def _compare_values_by_key(
+    table: Table,
+    key_columns: List[str],
+    compare_columns: List[str],
+    keep: str = "last",
+) -> Dict[Tuple[str, ...], Tuple[str, ...]]:
+    """key -> tuple of the compare column values of the first or last row.
+
+    Built column-wise, so equal rows can be skipped with one tuple
+    comparison instead of a lookup per column.
+    """
+    keys = list(zip(*(table.column(col) for col in key_columns)))
+    values = list(zip(*(table.column(col) for col in compare_columns)))
+    if keep == "first":
+        return dict(zip(reversed(keys), reversed(values)))
+    return dict(zip(keys, values))
+
+
+def _report_duplicates(
+    duplicates: Dict[str, Dict[Tuple[str, ...], List[Mapping]]],
+    paths: Dict[str, str],
+    key_columns: List[str],
+    keep: str,
+    output_path: str | None,
+) -> None:
+    """Warn about duplicated keys per file and optionally export them.
+
+    The export has one row per file and duplicated key, with its count.
+    """
+    for name, groups in duplicates.items():
+        if groups:
+            logger.warning(
+                "%d keys occur more than once in %s; using the %s row of each.",
+                len(groups),
+                paths[name],
+                keep,
+            )
+    if output_path:
+        with CsvSink(output_path, ["file"] + key_columns + ["count"]) as sink:
+            for name, groups in duplicates.items():
+                for key, group in groups.items():
+                    sink.write((name,) + key + (len(group),))
+        logger.info("Wrote duplicate keys to %s", output_path)
+
+
+def _report_by_index(
+    idx1: Dict[Tuple[str, ...], Dict[str, str]],
+    idx2: Dict[Tuple[str, ...], Dict[str, str]],
+    key_columns: List[str],
+    compare_columns: List[str],
+    diff_output_path: str | None,
+    only_in_1_output: str | None,
+    only_in_2_output: str | None,
+    full1: Callable[[Tuple[str, ...]], Dict[str, str]],
+    full2: Callable[[Tuple[str, ...]], Dict[str, str]],
+    fields1: List[str],
+    fields2: List[str],
+    log_rows: int | None = None,
+    compare_values: Tuple[Dict[Tuple[str, ...], Tuple[str, ...]], ...] | None = None,
+    fingerprint_column: str | None = None,
+    fingerprint_bits: int = 64,
+    order: str = "sorted",
+    numeric: Sequence[bool] | None = None,
+    tolerance: float = 0.0,
+) -> Tuple[int, int, Dict[str, int]]:
+    """Diff two key indexes and log/export the reports.
+
+    full1/full2 return the complete row for a key of file1/file2, and
+    fields1/fields2 are the column names used for the only-in exports.
+    At most log_rows rows per section are logged (None = all). With
+    compare_values (key -> tuple of the compare column values, per file)
+    only keys whose tuples differ are compared column by column.
+    fingerprint_column appends a row_fingerprint to only-in rows. order
+    is one of COMPARE_ORDERS; the file orders follow the insertion order
+    of idx1/idx2. numeric flags the compare columns whose differing
+    values are compared as numbers within tolerance.
+
+    Returns:
+        (rows only in file1, rows only in file2, differences per column).
+    """
+
+    only_in_1 = idx1.keys() - idx2.keys()
+    only_in_2 = idx2.keys() - idx1.keys()
+    in_both = idx1.keys() & idx2.keys()
+    if compare_values is not None:
+        values1, values2 = compare_values
+        in_both = {k for k in in_both if values1[k] != values2[k]}
 
-    keys1 = set(idx1.keys())
-    keys2 = set(idx2.keys())
+    def arrange(keys: set, file_order: Dict[Tuple[str, ...], Any]) -> Iterator[Tuple[str, ...]]:
+        if order == "sorted":
+            return iter(sorted(keys))
+        if order == "unordered":
+            return iter(keys)
+        return (k for k in file_order if k in keys)
 
-    only_in_1 = keys1 - keys2
-    only_in_2 = keys2 - keys1
-    in_both = keys1 & keys2
+    def export_only_in(
+        keys: set,
+        full: Callable[[Tuple[str, ...]], Dict[str, str]],
+        fields: List[str],
+        output: str | None,
+        side: int,
+        file_order: Dict[Tuple[str, ...], Any],
+    ) -> None:
+        header = fields
+        if fingerprint_column:
+            if fingerprint_column in fields:
+                raise ValueError(f"Column '{fingerprint_column}' already exists in file{side + 1}")
+            header = fields + [fingerprint_column]
+        rows_log = _RowLog(log_rows)
+        with CsvSink(output, header) as sink:
+            for k in arrange(keys, file_order):
+                row = full(k)
+                values = [row.get(name, "") for name in fields]
+                if fingerprint_column:
+                    fp = row_fingerprint([row.get(c) for c in compare_columns], fingerprint_bits)
+                    values.append(f"{fp:0{fingerprint_bits // 4}x}")
+                sink.write(values)
+                rows_log("  key=%s -> %s", k, row)
+        rows_log.close()
 
     # Export rows only in file1
     if only_in_1:
-        print("Rows only in file1:")
-        if only_in_1_output:
-            with open(only_in_1_output, "w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=rows1[0].keys())
-                writer.writeheader()
-                for k in sorted(only_in_1):
-                    writer.writerow(idx1[k])
-                    print(f"  key={k} -> {idx1[k]}")
-        else:
-            for k in sorted(only_in_1):
-                print(f"  key={k} -> {idx1[k]}")
-        print("-" * 60)
+        logger.info("Rows only in file1:")
+        export_only_in(only_in_1, full1, fields1, only_in_1_output, 0, idx1)
+        logger.info("-" * 60)
 
     # Export rows only in file2
     if only_in_2:
-        print("Rows only in file2:")
-        if only_in_2_output:
-            with open(only_in_2_output, "w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=rows2[0].keys())
-                writer.writeheader()
-                for k in sorted(only_in_2):
-                    writer.writerow(idx2[k])
-                    print(f"  key={k} -> {idx2[k]}")
-        else:
-            for k in sorted(only_in_2):
-                print(f"  key={k} -> {idx2[k]}")
-        print("-" * 60)
-
-    # Collect column differences for matched keys
-    diff_rows: List[Dict[str, Any]] = []
-    for k in sorted(in_both):
-        r1 = idx1[k]
-        r2 = idx2[k]
+        logger.info("Rows only in file2:")
+        export_only_in(only_in_2, full2, fields2, only_in_2_output, 1, idx2)
+        logger.info("-" * 60)
+
+    # One row per mismatched key+column; the file is only created if needed
+    diffs = CsvSink(
+        diff_output_path, key_columns + ["column", "value_file1", "value_file2"], lazy=True
+    )
+    by_column = dict.fromkeys(compare_columns, 0)
+    numeric = numeric or [False] * len(compare_columns)
+    rows_log = _RowLog(log_rows)
+    with diffs:
+        for k in arrange(in_both, idx2 if order == "file2" else idx1):
+            r1 = idx1[k]
+            r2 = idx2[k]
+            for col, is_num in zip(compare_columns, numeric):
+                v1 = r1.get(col, "")
+                v2 = r2.get(col, "")
+                if v1 != v2 and not (is_num and _numbers_equal(v1, v2, tolerance)):
+                    diffs.write(k + (col, v1, v2))
+                    by_column[col] += 1
+                    rows_log("Diff key=%s, column=%s: '%s' vs '%s'", k, col, v1, v2)
+    rows_log.close()
+
+    if diff_output_path and diffs.count:
+        logger.info("Wrote %d differences to %s", diffs.count, diff_output_path)
+    elif diff_output_path:
+        logger.info("No column differences found; diff CSV not created.")
+
+    if not only_in_1 and not only_in_2 and not diffs.count:
+        logger.info("No differences found for the given key/compare columns.")
+    return len(only_in_1), len(only_in_2), by_column
+
+
+class _RowLog:
+    """Log per-row report lines up to limit (None = all), then just count them.
+
+    Nothing is formatted when INFO is disabled.
+    """
+
+    def __init__(self, limit: int | None) -> None:
+        self.limit = limit
+        self.count = 0
+        self.enabled = logger.isEnabledFor(logging.INFO)
+
+    def __call__(self, msg: str, *args: Any) -> None:
+        self.count += 1
+        if self.enabled and (self.limit is None or self.count <= self.limit):
+            logger.info(msg, *args)
+
+    def close(self) -> None:
+        """Log how many rows were left out."""
+        if self.enabled and self.limit is not None and self.count > self.limit:
+            logger.info("  ... %d more", self.count - self.limit)
+
+
+def _spill_run(records: List[Tuple[Tuple[str, ...], List[str]]], tmpdir: str) -> str:
+    """Sort records by key and pickle them to a new run file in tmpdir."""
+    records.sort(key=lambda rec: rec[0])
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmpdir)
+    with os.fdopen(fd, "wb") as f:
+        for rec in records:
+            pickle.dump(rec, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path: str) -> Iterator[Tuple[Tuple[str, ...], List[str]]]:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+# Most runs open at once in one merge; keeps two files' merges well under
+# the common 1024 open files limit
+_MAX_MERGE_RUNS = 100
+
+
+def _merge_runs(runs: List[str], tmpdir: str) -> List[str]:
+    """Merge runs in passes until at most _MAX_MERGE_RUNS are left.
+
+    Each pass merges consecutive groups of runs into one new run, so a
+    duplicate key's rows keep their file order.
+    """
+    while len(runs) > _MAX_MERGE_RUNS:
+        merged_runs = []
+        for start in range(0, len(runs), _MAX_MERGE_RUNS):
+            group = runs[start:start + _MAX_MERGE_RUNS]
+            if len(group) == 1:
+                merged_runs.append(group[0])
+                continue
+            fd, path = tempfile.mkstemp(suffix=".run", dir=tmpdir)
+            with os.fdopen(fd, "wb") as f:
+                for rec in heapq.merge(*(_read_run(p) for p in group), key=lambda rec: rec[0]):
+                    pickle.dump(rec, f, pickle.HIGHEST_PROTOCOL)
+            for p in group:
+                os.remove(p)
+            merged_runs.append(path)
+        runs = merged_runs
+    return runs
+
+
+def _external_sorted(
+    path: str,
+    key_columns: List[str],
+    chunk_rows: int,
+    tmpdir: str,
+) -> Tuple[List[str], Iterator[Tuple[Tuple[str, ...], List[str]]]]:
+    """Sort a CSV by key_columns using bounded-memory runs spilled to tmpdir.
+
+    Returns (header, iterator of (key, values)) in key order. Like
+    index_by_keys, only the last row seen for a duplicate key is kept.
+    """
+    runs: List[str] = []
+    header: List[str] = []
+    with contextlib.closing(iter_csv(path)) as rows:
+        chunk: List[Tuple[Tuple[str, ...], List[str]]] = []
+        for r in rows:
+            if not header:
+                header = list(r.keys())
+                for col in key_columns:
+                    if col not in r:
+                        raise ValueError(f"Key column '{col}' not found in CSV")
+            key = tuple(r.get(col, "") for col in key_columns)
+            chunk.append((key, [r.get(h) for h in header]))
+            if len(chunk) >= chunk_rows:
+                runs.append(_spill_run(chunk, tmpdir))
+                chunk = []
+        if chunk:
+            runs.append(_spill_run(chunk, tmpdir))
+
+    # heapq.merge is stable across runs, so duplicates stay in file order
+    runs = _merge_runs(runs, tmpdir)
+    merged = heapq.merge(*(_read_run(p) for p in runs), key=lambda rec: rec[0])
+    deduped = (
+        list(group)[-1]
+        for _, group in itertools.groupby(merged, key=lambda rec: rec[0])
+    )
+    return header, deduped
+
+
+def _compare_csv_external(
+    file1: str,
+    file2: str,
+    key_columns: List[str],
+    compare_columns: List[str],
+    diff_output_path: str | None,
+    only_in_1_output: str | None,
+    only_in_2_output: str | None,
+    chunk_rows: int,
+    numeric: Sequence[bool] | None = None,
+    tolerance: float = 0.0,
+) -> Tuple[int, int, Dict[str, int]] | None:
+    """Sort-merge diff behind compare_csv_by_keys(external=True)."""
+    with tempfile.TemporaryDirectory(prefix="comparecsv_") as tmpdir:
+        header1, sorted1 = _external_sorted(file1, key_columns, chunk_rows, tmpdir)
+        if not header1:
+            logger.warning("%s has no data.", file1)
+            return None
+        header2, sorted2 = _external_sorted(file2, key_columns, chunk_rows, tmpdir)
+        if not header2:
+            logger.warning("%s has no data.", file2)
+            return None
+
         for col in compare_columns:
-            v1 = r1.get(col, "")
-            v2 = r2.get(col, "")
-            if v1 != v2:
-                # One row per mismatched key+column
-                row_out: Dict[str, Any] = {}
-                for i, key_col in enumerate(key_columns):
-                    row_out[key_col] = k[i]
-                row_out["column"] = col
-                row_out["value_file1"] = v1
-                row_out["value_file2"] = v2
-                diff_rows.append(row_out)
-                print(f"Diff key={k}, column={col}: '{v1}' vs '{v2}'")
-
-    # Export differences
-    if diff_output_path and diff_rows:
-        fieldnames = key_columns + ["column", "value_file1", "value_file2"]
-        with open(diff_output_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(diff_rows)
-        print(f"Wrote {len(diff_rows)} differences to {diff_output_path}")
+            if col not in header1:
+                raise ValueError(f"Column '{col}' not found in {file1}")
+            if col not in header2:
+                raise ValueError(f"Column '{col}' not found in {file2}")
+        pos1 = [header1.index(col) for col in compare_columns]
+        pos2 = [header2.index(col) for col in compare_columns]
+        numeric = numeric or [False] * len(compare_columns)
+
+        only1, only2, diffs = _compare_sinks(
+            header1, header2, key_columns, diff_output_path, only_in_1_output, only_in_2_output
+        )
+        by_column = dict.fromkeys(compare_columns, 0)
+        with only1, only2, diffs:
+            a = next(sorted1, None)
+            b = next(sorted2, None)
+            while a is not None or b is not None:
+                if b is None or (a is not None and a[0] < b[0]):
+                    only1.write(a[1])
+                    a = next(sorted1, None)
+                elif a is None or b[0] < a[0]:
+                    only2.write(b[1])
+                    b = next(sorted2, None)
+                else:
+                    key = a[0]
+                    for col, i1, i2, is_num in zip(compare_columns, pos1, pos2, numeric):
+                        v1 = a[1][i1]
+                        v2 = b[1][i2]
+                        if v1 != v2 and not (is_num and _numbers_equal(v1, v2, tolerance)):
+                            diffs.write(key + (col, v1, v2))
+                            by_column[col] += 1
+                    a = next(sorted1, None)
+                    b = next(sorted2, None)
+
+    _print_compare_summary(only1, only2, diffs, diff_output_path)
+    return only1.count, only2.count, by_column
+
+
+class _RowSink(CsvSink):
+    """Lazy CsvSink for full rows whose header may repeat a column name.
+
+    Like writing dict(zip(header, row)), a repeated name is written once,
+    with its last value.
+    """
+
+    def __init__(self, path: str | None, header: List[str]) -> None:
+        names, idx = _projection(header, None, path or "<rows>")
+        super().__init__(path, names, lazy=True)
+        self._idx = None if idx == list(range(len(header))) else idx
+
+    def write(self, row: Sequence[Any]) -> None:
+        if self._idx is not None:
+            row = [row[i] for i in self._idx]
+        super().write(row)
+
+
+def _compare_sinks(
+    header1: List[str],
+    header2: List[str],
+    key_columns: List[str],
+    diff_output_path: str | None,
+    only_in_1_output: str | None,
+    only_in_2_output: str | None,
+) -> Tuple[CsvSink, CsvSink, CsvSink]:
+    """The only-in-1, only-in-2 and diff outputs of the streaming compares."""
+    return (
+        _RowSink(only_in_1_output, header1),
+        _RowSink(only_in_2_output, header2),
+        CsvSink(
+            diff_output_path,
+            key_columns + ["column", "value_file1", "value_file2"],
+            lazy=True,
+        ),
+    )
+
+
+def _print_compare_summary(
+    only1: CsvSink,
+    only2: CsvSink,
+    diffs: CsvSink,
+    diff_output_path: str | None,
+) -> None:
+    """Log the count-only summary used by the external/parallel compares."""
+    if only1.count:
+        logger.info("Rows only in file1: %d", only1.count)
+    if only2.count:
+        logger.info("Rows only in file2: %d", only2.count)
+    if diff_output_path and diffs.count:
+        logger.info("Wrote %d differences to %s", diffs.count, diff_output_path)
     elif diff_output_path:
-        print("No column differences found; diff CSV not created.")
+        logger.info("No column differences found; diff CSV not created.")
+
+    if not only1.count and not only2.count and not diffs.count:
+        logger.info("No differences found for the given key/compare columns.")
+
+
+# Target size of the CSV text that lands in one bucket pair of a partitioned
+# compare; a worker holds one pair as two dicts while diffing it.
+_COMPARE_BUCKET_BYTES = 64 * 1024 * 1024
+
+
+def _compare_header(
+    path: str, key_columns: List[str], compare_columns: List[str]
+) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """Header of path and the byte ranges of its data rows for parallel reading.
+
+    The key and compare columns are checked when there is data. Returns
+    ([], []) for an empty file.
+    """
+    record = next(_iter_offset_records(path), None)
+    if record is None:
+        return [], []
+    offset, length, header = record
+    header_end = offset + length
+    size = os.path.getsize(path)
+    parts = max(1, -(-(size - header_end) // _PARALLEL_CHUNK_BYTES))
+    ranges = _chunk_ranges(path, header_end, parts)
+    if ranges:
+        positions = _field_positions(header)
+        for col in key_columns:
+            if col not in positions:
+                raise ValueError(f"Key column '{col}' not found in CSV")
+        for col in compare_columns:
+            if col not in positions:
+                raise ValueError(f"Column '{col}' not found in {path}")
+    return header, ranges
 
-    if not only_in_1 and not only_in_2 and not diff_rows:
-        print("No differences found for the given key/compare columns.")
 
+def _hash_partition_chunk(
+    path: str,
+    byte_range: Tuple[int, int],
+    width: int,
+    key_pos: List[int],
+    parts: int,
+    prefix: str,
+) -> Tuple[int, List[int]]:
+    """Worker: spill the rows of one byte range to bucket files by key hash.
+
+    Bucket b is written to prefix + '_b.bucket', and only if it got rows.
+    Returns (rows read, bucket numbers written).
+    """
+    start, end = byte_range
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+    buckets: Dict[int, List[Tuple[Tuple[str, ...], List[str]]]] = {}
+    count = 0
+    for row in _data_rows(csv.reader(io.StringIO(text, newline="")), width):
+        key = tuple(row[i] for i in key_pos)
+        buckets.setdefault(_key_hash(key) % parts, []).append((key, row))
+        count += 1
+    for b, records in buckets.items():
+        with open(f"{prefix}_{b}.bucket", "wb") as out:
+            for rec in records:
+                pickle.dump(rec, out, pickle.HIGHEST_PROTOCOL)
+    return count, sorted(buckets)
+
+
+def _diff_bucket(
+    bucket1: Sequence[str],
+    bucket2: Sequence[str],
+    prefix: str,
+    pos1: List[int],
+    pos2: List[int],
+    compare_columns: List[str],
+    ordered: bool = True,
+    numeric: Sequence[bool] | None = None,
+    tolerance: float = 0.0,
+) -> Tuple[str, str, str]:
+    """Worker: diff one bucket pair and write result runs, key-sorted if ordered.
+
+    bucket1 and bucket2 are the pair's spill files in file order, so the
+    last row of a duplicated key wins. Returns the paths of the only-in-1,
+    only-in-2 and column-diff runs, which start with prefix.
+    """
+    arrange = sorted if ordered else iter
+    idx1 = dict(itertools.chain.from_iterable(_read_run(p) for p in bucket1))
+    idx2 = dict(itertools.chain.from_iterable(_read_run(p) for p in bucket2))
+    out = (prefix + ".only1", prefix + ".only2", prefix + ".diff")
+    with open(out[0], "wb") as f:
+        for k in arrange(idx1.keys() - idx2.keys()):
+            pickle.dump((k, idx1[k]), f, pickle.HIGHEST_PROTOCOL)
+    with open(out[1], "wb") as f:
+        for k in arrange(idx2.keys() - idx1.keys()):
+            pickle.dump((k, idx2[k]), f, pickle.HIGHEST_PROTOCOL)
+    numeric = numeric or [False] * len(compare_columns)
+    with open(out[2], "wb") as f:
+        for k in arrange(idx1.keys() & idx2.keys()):
+            r1 = idx1[k]
+            r2 = idx2[k]
+            for col, i1, i2, is_num in zip(compare_columns, pos1, pos2, numeric):
+                v1 = r1[i1]
+                v2 = r2[i2]
+                if v1 != v2 and not (is_num and _numbers_equal(v1, v2, tolerance)):
+                    pickle.dump((k, col, v1, v2), f, pickle.HIGHEST_PROTOCOL)
+    return out
+
+
+def _compare_csv_partitioned(
+    file1: str,
+    file2: str,
+    key_columns: List[str],
+    compare_columns: List[str],
+    diff_output_path: str | None,
+    only_in_1_output: str | None,
+    only_in_2_output: str | None,
+    workers: int,
+    order: str = "sorted",
+    numeric: Sequence[bool] | None = None,
+    tolerance: float = 0.0,
+) -> Tuple[int, int, Dict[str, int]] | None:
+    """Hash-partitioned parallel diff behind compare_csv_by_keys(workers=N).
+
+    Both files are cut into byte ranges on record boundaries, and the
+    workers spill the rows of each range into buckets by key hash, so a
+    key always lands in the same bucket pair. There are more buckets than
+    workers (about _COMPARE_BUCKET_BYTES of input each), which keeps the
+    memory for diffing one pair bounded. Each pair is diffed in a worker,
+    and the key-sorted per-bucket results are merged into the usual reports.
+    """
+    header1, ranges1 = _compare_header(file1, key_columns, compare_columns)
+    header2, ranges2 = _compare_header(file2, key_columns, compare_columns)
+    data_bytes = sum(end - start for start, end in itertools.chain(ranges1, ranges2))
+    parts = max(4 * workers, -(-data_bytes // _COMPARE_BUCKET_BYTES))
+    positions1 = _field_positions(header1)
+    positions2 = _field_positions(header2)
+
+    with tempfile.TemporaryDirectory(prefix="comparecsv_") as tmpdir:
+        # One spill job per byte range of either file, in file order.
+        tags: List[str] = []
+        paths: List[str] = []
+        byte_ranges: List[Tuple[int, int]] = []
+        widths: List[int] = []
+        key_pos: List[List[int]] = []
+        prefixes: List[str] = []
+        for tag, path, header, positions, ranges in (
+            ("1", file1, header1, positions1, ranges1),
+            ("2", file2, header2, positions2, ranges2),
+        ):
+            for c, byte_range in enumerate(ranges):
+                tags.append(tag)
+                paths.append(path)
+                byte_ranges.append(byte_range)
+                widths.append(len(header))
+                key_pos.append([positions[col] for col in key_columns])
+                prefixes.append(os.path.join(tmpdir, f"{tag}_{c}"))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            spilled = pool.map(
+                _hash_partition_chunk,
+                paths,
+                byte_ranges,
+                widths,
+                key_pos,
+                itertools.repeat(parts),
+                prefixes,
+            )
+            rows = {"1": 0, "2": 0}
+            buckets: Dict[str, List[List[str]]] = {tag: [[] for _ in range(parts)] for tag in rows}
+            for tag, prefix, (count, written) in zip(tags, prefixes, spilled):
+                rows[tag] += count
+                for b in written:
+                    buckets[tag][b].append(f"{prefix}_{b}.bucket")
+            if not rows["1"]:
+                logger.warning("%s has no data.", file1)
+                return None
+            if not rows["2"]:
+                logger.warning("%s has no data.", file2)
+                return None
+            pos1 = [positions1[col] for col in compare_columns]
+            pos2 = [positions2[col] for col in compare_columns]
+
+            runs = list(pool.map(
+                _diff_bucket,
+                buckets["1"],
+                buckets["2"],
+                [os.path.join(tmpdir, f"diff_{b}") for b in range(parts)],
+                itertools.repeat(pos1),
+                itertools.repeat(pos2),
+                itertools.repeat(compare_columns),
+                itertools.repeat(order != "unordered"),
+                itertools.repeat(numeric),
+                itertools.repeat(tolerance),
+            ))
+
+        def merged(which: int) -> Iterator[Tuple[Any, ...]]:
+            paths = [r[which] for r in runs]
+            if order == "unordered":
+                return itertools.chain.from_iterable(_read_run(p) for p in paths)
+            paths = _merge_runs(paths, tmpdir)
+            return heapq.merge(*(_read_run(p) for p in paths), key=lambda rec: rec[0])
+
+        only1, only2, diffs = _compare_sinks(
+            header1, header2, key_columns, diff_output_path, only_in_1_output, only_in_2_output
+        )
+        by_column = dict.fromkeys(compare_columns, 0)
+        with only1, only2, diffs:
+            for _, row in merged(0):
+                only1.write(row)
+            for _, row in merged(1):
+                only2.write(row)
+            for key, col, v1, v2 in merged(2):
+                diffs.write(key + (col, v1, v2))
+                by_column[col] += 1
+
+    _print_compare_summary(only1, only2, diffs, diff_output_path)
+    return only1.count, only2.count, by_column
+
+
+class CompareSnapshot:
+    """Stored key -> row hash index of one CSV export, for incremental compares.
+
+    A snapshot is two files: path, an index of key -> (hash of the
+    compare columns, byte offset, byte length), and path + '.csv', a copy
+    of the CSV those byte ranges point into. Comparing a newer export
+    against it only reads the new file: rows whose hash is unchanged are
+    skipped, and old rows are fetched by offset just for the keys that
+    were removed or changed.
+
+    Index layout, like ColumnIndex: magic, a length-prefixed JSON block
+    (source, key and compare columns, header, keys in file order), then
+    the hashes, offsets and lengths as little-endian arrays.
+    """
+
+    MAGIC = b"CMPSNAP2"
+
+    def __init__(self, path: str) -> None:
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    raise ValueError
+                (meta_len,) = struct.unpack("<I", f.read(4))
+                meta = json.loads(f.read(meta_len))
+                keys = [tuple(k) for k in meta["keys"]]
+                hashes = _le_array("Q", f, len(keys))
+                offsets = _le_array("Q", f, len(keys))
+                lengths = _le_array("I", f, len(keys))
+                self.source: str = meta["source"]
+                self.key_columns: List[str] = meta["key_columns"]
+                self.compare_columns: List[str] = meta["compare_columns"]
+                self.header: List[str] = meta["header"]
+        except (ValueError, KeyError, TypeError, EOFError, struct.error):
+            raise ValueError(f"{path} is not a compare snapshot") from None
+        self.path = path
+        self.csv_path = path + ".csv"
+        self.rows: Dict[Tuple[str, ...], Tuple[int, int, int]] = dict(
+            zip(keys, zip(hashes, offsets, lengths))
+        )
+
+    @staticmethod
+    def scan(
+        csv_path: str,
+        key_columns: List[str],
+        compare_columns: List[str],
+        name: str | None = None,
+    ) -> Tuple[List[str], Dict[Tuple[str, ...], Tuple[int, int, int]]]:
+        """Hash the compare columns of every row of csv_path in one pass.
+
+        Returns (header, key -> (hash, byte offset, byte length)); like
+        index_by_keys, the last row wins for a duplicate key. name is the
+        file name used in error messages (default: csv_path).
+        """
+        header: List[str] = []
+        rows: Dict[Tuple[str, ...], Tuple[int, int, int]] = {}
+        key_pos: List[int] | None = None
+        cmp_pos: List[int] = []
+        for offset, length, fields in _iter_offset_records(csv_path):
+            if key_pos is None:
+                header = fields
+                positions = _field_positions(fields)
+                for col in key_columns:
+                    if col not in positions:
+                        raise ValueError(f"Key column '{col}' not found in CSV")
+                for col in compare_columns:
+                    if col not in positions:
+                        raise ValueError(f"Column '{col}' not found in {name or csv_path}")
+                key_pos = [positions[col] for col in key_columns]
+                cmp_pos = [positions[col] for col in compare_columns]
+                continue
+            if len(fields) < len(header):
+                fields = fields + [""] * (len(header) - len(fields))
+            key = tuple(fields[i] for i in key_pos)
+            rows[key] = (row_fingerprint([fields[i] for i in cmp_pos]), offset, length)
+        return header, rows
 
-def main() -> None:
+    @classmethod
+    def save(
+        cls,
+        path: str,
+        csv_path: str,
+        key_columns: List[str],
+        compare_columns: List[str],
+    ) -> None:
+        """Store csv_path as the snapshot at path."""
+        tmp_csv = path + ".csv.tmp"
+        shutil.copyfile(csv_path, tmp_csv)
+        try:
+            header, rows = cls.scan(tmp_csv, key_columns, compare_columns, csv_path)
+            cls._commit(path, tmp_csv, csv_path, key_columns, compare_columns, header, rows)
+        finally:
+            if os.path.exists(tmp_csv):
+                os.remove(tmp_csv)
+
+    @classmethod
+    def _commit(
+        cls,
+        path: str,
+        tmp_csv: str,
+        source: str,
+        key_columns: List[str],
+        compare_columns: List[str],
+        header: List[str],
+        rows: Dict[Tuple[str, ...], Tuple[int, int, int]],
+    ) -> None:
+        """Write the index for the already scanned copy tmp_csv and move both in place."""
+        meta = json.dumps({
+            "source": source,
+            "key_columns": list(key_columns),
+            "compare_columns": list(compare_columns),
+            "header": header,
+            "keys": list(rows),
+        }).encode("utf-8")
+        spans = list(rows.values())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack("<I", len(meta)))
+            f.write(meta)
+            for typecode, column in zip("QQI", zip(*spans) if spans else ((), (), ())):
+                f.write(_le_bytes(array(typecode, column)))
+        os.replace(tmp_csv, path + ".csv")
+        os.replace(tmp_path, path)
+
+    def fetch(self, keys: Sequence[Tuple[str, ...]]) -> Dict[Tuple[str, ...], Dict[str, str]]:
+        """Full rows of the stored CSV for keys, read by byte offset, in snapshot order."""
+        wanted = set(keys)
+        return _fetch_spans(
+            self.csv_path, self.header, {k: v for k, v in self.rows.items() if k in wanted}
+        )
+
+
+def _fetch_spans(
+    path: str,
+    header: List[str],
+    spans: Dict[Tuple[str, ...], Tuple[int, int, int]],
+) -> Dict[Tuple[str, ...], Dict[str, str]]:
+    """Read the rows at the (hash, offset, length) spans of path.
+
+    The file is read in offset order, but the result keeps the key order
+    of spans, which for a scan is the order keys first appear in the file.
+    """
+    rows: Dict[Tuple[str, ...], Dict[str, str]] = dict.fromkeys(spans)  # type: ignore[arg-type]
+    width = len(header)
+    with open(path, "rb") as f:
+        for key, (_, offset, length) in sorted(spans.items(), key=lambda item: item[1][1]):
+            f.seek(offset)
+            fields = _parse_record(f.read(length))
+            if len(fields) != width:
+                fields = (fields + [None] * width)[:width]
+            rows[key] = dict(zip(header, fields))
+    return rows
+
+
+def compare_csv_with_snapshot(
+    snapshot_path: str,
+    file2: str,
+    key_columns: List[str],
+    compare_columns: List[str],
+    diff_output_path: str | None = "differences.csv",
+    only_in_1_output: str | None = "only_in_file1.csv",
+    only_in_2_output: str | None = "only_in_file2.csv",
+    update: bool = True,
+    log_rows: int | None = None,
+    summary_path: str | None = None,
+    order: str = "sorted",
+    numeric_columns: Sequence[str] | None = None,
+    tolerance: float = 0.0,
+) -> Dict[str, Any] | None:
+    """Compare a new export against the CompareSnapshot of an earlier one.
+
+    Gives the same reports as compare_csv_by_keys(snapshot source, file2,
+    ...), but only file2 is read: each of its rows is hashed over
+    compare_columns and looked up in the stored index, and full rows are
+    only parsed for keys that were added, removed or changed.
+
+    If snapshot_path does not exist yet, file2 is stored as the first
+    snapshot and None is returned. A snapshot without rows is compared
+    like any other, so every row of file2 is reported as only in file2.
+    With update=True (the default) file2 replaces the snapshot
+    afterwards, ready for the next run. order is as in
+    compare_csv_by_keys, "file1" meaning the snapshot's row order.
+    numeric_columns and tolerance are as in compare_csv_by_keys; a row
+    whose hash changed only in number formatting is fetched but reports
+    no difference.
+
+    Returns:
+        The compare summary (see compare_csv_by_keys), or None.
+    """
+    if order not in COMPARE_ORDERS:
+        raise ValueError(f"order must be one of {', '.join(COMPARE_ORDERS)}")
+    started = time.perf_counter()
+    if not os.path.exists(snapshot_path):
+        CompareSnapshot.save(snapshot_path, file2, key_columns, compare_columns)
+        logger.info("No snapshot at %s yet; stored %s as the baseline.", snapshot_path, file2)
+        return None
+    old = CompareSnapshot(snapshot_path)
+    if old.key_columns != list(key_columns) or old.compare_columns != list(compare_columns):
+        raise ValueError(
+            f"Snapshot {snapshot_path} was made with key columns {old.key_columns} "
+            f"and compare columns {old.compare_columns}"
+        )
+    if not old.rows:
+        # Still compare and update, or the snapshot would stay empty for good
+        logger.warning("%s has no data; every row of %s is new.", snapshot_path, file2)
+
+    # With update the new file is copied first and the copy is what gets
+    # scanned, so the stored offsets always match the stored CSV
+    new_csv = file2
+    if update:
+        new_csv = snapshot_path + ".csv.tmp"
+        shutil.copyfile(file2, new_csv)
+    try:
+        header2, rows2 = CompareSnapshot.scan(new_csv, key_columns, compare_columns, file2)
+        if not rows2:
+            logger.warning("%s has no data.", file2)
+            return None
+
+        only_in_1 = old.rows.keys() - rows2.keys()
+        only_in_2 = rows2.keys() - old.rows.keys()
+        changed = [
+            k for k, (h, _, _) in rows2.items() if k in old.rows and old.rows[k][0] != h
+        ]
+        idx1 = old.fetch(list(only_in_1) + changed)
+        wanted = only_in_2.union(changed)
+        idx2 = _fetch_spans(new_csv, header2, {k: v for k, v in rows2.items() if k in wanted})
+        result = _report_by_index(
+            idx1,
+            idx2,
+            key_columns,
+            compare_columns,
+            diff_output_path,
+            only_in_1_output,
+            only_in_2_output,
+            idx1.get,
+            idx2.get,
+            list(dict.fromkeys(old.header)),
+            list(dict.fromkeys(header2)),
+            log_rows,
+            order=order,
+            numeric=[col in set(numeric_columns or ()) for col in compare_columns],
+            tolerance=tolerance,
+        )
+        if update:
+            CompareSnapshot._commit(
+                snapshot_path, new_csv, file2, key_columns, compare_columns, header2, rows2
+            )
+    finally:
+        if update and os.path.exists(new_csv):
+            os.remove(new_csv)
+
+    return _compare_summary(
+        old.source,
+        file2,
+        key_columns,
+        compare_columns,
+        "snapshot",
+        result,
+        diff_output_path,
+        only_in_1_output,
+        only_in_2_output,
+        started,
+        summary_path,
+    )
+
+
+def main(argv: List[str] | None = None) -> None:
     """Example usage; edit paths/column names to your data."""
+    parser = argparse.ArgumentParser(description="Filter and compare CSV exports.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes to use for the filters (default: 1, no pool)",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="minimum level of messages to show (default: INFO)",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="only show warnings and errors (same as --log-level WARNING)",
+    )
+    args = parser.parse_args(argv)
+    logger.setLevel("WARNING" if args.quiet else args.log_level)
+
     # Example 1: filter by brand == "Zyn"
     # Change these values to match your CSV
     # source_csv = "data.csv"      # input file
@@ -334,6 +4535,15 @@ def main() -> None:
     #     unmatched_output = "Products_Without_Brand_77_Att.csv"
     # )
     # print(f"Found {len(matched)} rows with 77 and {len(unmatched)} rows without 77.\n")
+
+    # Example 1c: the two steps above as one scan with a filter expression
+    # both_77 = filter_rows(
+    #     "file1.csv",
+    #     Prefix("Name", "77", case_sensitive=False)
+    #     & Eq("Attribute 2 value(s)", "77"),
+    #     output_path="Products_With_Brand_77_Att.csv",
+    # )
+    # print(f"Found {len(both_77)} rows named '77...' with 77 in Attribute 2.\n")
     
 
     # Example 2: compare two CSVs by key and columns
@@ -351,14 +4561,17 @@ def main() -> None:
     #     diff_output_path="differences.csv",
     #     only_in_1_output="only_in_file1.csv",
     #     only_in_2_output="only_in_file2.csv",
+    #     log_rows=20,                     # per-row lines per section
+    #     summary_path="summary.json",     # JSON summary of the compare
     # )
 
     cuba_matches = filter_rows_name_matches_cuba(
         "cuba.csv",
         output_path="cuba_matches.csv",
         column_name="Name",
+        workers=args.workers,
     )
-    print(f"Found {len(cuba_matches)} rows matching Cuba variants in Name.\n")
+    logger.info("Found %d rows matching Cuba variants in Name.\n", len(cuba_matches))
 
 
 if __name__ == "__main__":
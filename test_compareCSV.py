@@ -0,0 +1,182 @@
+"""Equivalence tests: every fast path must give the same output as the plain one."""
+
+import csv
+import io
+import os
+
+import pytest
+
+import compareCSV
+
+
+HEADER = ["ID", "SKU", "Name", "Description", "Type", "Regular price", "Stock"]
+BRANDS = ["Cohiba", "Montecristo", "Partagas", "Romeo y Julieta", "cohiba-like"]
+
+
+def _rows(n, changed=False):
+    """Rows of a small WooCommerce-like export, with duplicate SKUs and quoted newlines."""
+    rows = []
+    for i in range(n):
+        if changed and (i % 7 == 0 or i % 40 == 3):
+            continue
+        brand = BRANDS[i % len(BRANDS)]
+        price = f"{10 + i % 13}.50"
+        if changed and i % 5 == 0:
+            price = f"{11 + i % 13}.50"
+        rows.append([
+            str(1000 + i),
+            f"SKU-{i % 40}",
+            f"{brand} Robusto {i}",
+            f'Line one, "quoted"\nline two of {i}',
+            ["simple", "variable", "variation"][i % 3],
+            price,
+            str(i % 9),
+        ])
+    if changed:
+        rows.append(["9999", "SKU-NEW", "Cohiba Siglo VI", "", "simple", "99.00", "1"])
+    return rows
+
+
+def _write_csv(path, rows, crlf=False):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\r\n" if crlf else "\n")
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    return str(path)
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _same_reports(paths_a, paths_b):
+    """Both compares wrote the same report files, byte for byte (empty ones are never created)."""
+    for a, b in zip(paths_a, paths_b):
+        assert os.path.exists(a) == os.path.exists(b)
+        if os.path.exists(a):
+            assert _read_bytes(a) == _read_bytes(b)
+
+
+@pytest.fixture
+def exports(tmp_path):
+    old = _write_csv(tmp_path / "old.csv", _rows(120))
+    new = _write_csv(tmp_path / "new.csv", _rows(120, changed=True))
+    return old, new
+
+
+def _compare_outputs(tmp_path, name):
+    return [str(tmp_path / f"{name}_{part}.csv") for part in ("diff", "only1", "only2")]
+
+
+def test_chunk_ranges_split_on_record_boundaries(tmp_path):
+    path = _write_csv(tmp_path / "quoted.csv", _rows(60))
+    offset, length, _ = next(compareCSV._iter_offset_records(path))
+    header_end = offset + length
+    with open(path, newline="", encoding="utf-8") as f:
+        expected = list(csv.reader(f))[1:]
+
+    for parts in (1, 2, 7, 500):
+        ranges = compareCSV._chunk_ranges(path, header_end, parts)
+        assert ranges[0][0] == header_end
+        assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+        rows = []
+        for start, end in ranges:
+            text = _read_bytes(path)[start:end].decode("utf-8")
+            rows.extend(csv.reader(io.StringIO(text, newline="")))
+        assert rows == expected
+
+
+@pytest.mark.parametrize("crlf", [False, True])
+def test_parallel_filter_matches_serial(tmp_path, monkeypatch, crlf):
+    path = _write_csv(tmp_path / "in.csv", _rows(90), crlf=crlf)
+    monkeypatch.setattr(compareCSV, "_PARALLEL_CHUNK_BYTES", 64)
+
+    serial = compareCSV.filter_rows_by_column(path, "Type", "variation", str(tmp_path / "a.csv"))
+    parallel = compareCSV.filter_rows_by_column(
+        path, "Type", "variation", str(tmp_path / "b.csv"), workers=3
+    )
+    assert parallel == serial
+    assert _read_bytes(tmp_path / "b.csv") == _read_bytes(tmp_path / "a.csv")
+
+
+def test_external_compare_matches_in_memory(tmp_path, monkeypatch, exports):
+    old, new = exports
+    monkeypatch.setattr(compareCSV, "_MAX_MERGE_RUNS", 2)
+    plain = _compare_outputs(tmp_path, "plain")
+    external = _compare_outputs(tmp_path, "external")
+
+    compareCSV.compare_csv_by_keys(old, new, ["SKU"], ["Regular price", "Stock"], *plain)
+    compareCSV.compare_csv_by_keys(
+        old, new, ["SKU"], ["Regular price", "Stock"], *external, external=True, chunk_rows=3
+    )
+    _same_reports(plain, external)
+
+
+def test_partitioned_compare_matches_in_memory(tmp_path, monkeypatch, exports):
+    old, new = exports
+    monkeypatch.setattr(compareCSV, "_PARALLEL_CHUNK_BYTES", 256)
+    monkeypatch.setattr(compareCSV, "_COMPARE_BUCKET_BYTES", 512)
+    plain = _compare_outputs(tmp_path, "plain")
+    partitioned = _compare_outputs(tmp_path, "partitioned")
+
+    compareCSV.compare_csv_by_keys(old, new, ["SKU"], ["Regular price", "Stock"], *plain)
+    compareCSV.compare_csv_by_keys(
+        old, new, ["SKU"], ["Regular price", "Stock"], *partitioned, workers=2
+    )
+    _same_reports(plain, partitioned)
+
+
+@pytest.mark.parametrize("order", ["sorted", "file1", "file2"])
+def test_snapshot_compare_matches_compare_by_keys(tmp_path, exports, order):
+    old, new = exports
+    snapshot = str(tmp_path / "old.snap")
+    plain = _compare_outputs(tmp_path, "plain")
+    incremental = _compare_outputs(tmp_path, "snapshot")
+
+    assert compareCSV.compare_csv_with_snapshot(snapshot, old, ["SKU"], ["Regular price"]) is None
+    compareCSV.compare_csv_by_keys(old, new, ["SKU"], ["Regular price"], *plain, order=order)
+    compareCSV.compare_csv_with_snapshot(
+        snapshot, new, ["SKU"], ["Regular price"], *incremental, update=False, order=order
+    )
+    _same_reports(plain, incremental)
+
+
+def test_snapshot_rejects_other_files(tmp_path, exports):
+    old, _ = exports
+    with pytest.raises(ValueError, match="not a compare snapshot"):
+        compareCSV.CompareSnapshot(old)
+
+
+@pytest.mark.parametrize(
+    "prefix, case_sensitive",
+    [("Cohiba", True), ("cohiba", False), ("Romeo y", True), ("Zzz", True), ("", True)],
+)
+def test_prefix_index_matches_scan(tmp_path, prefix, case_sensitive):
+    path = _write_csv(tmp_path / "in.csv", _rows(80))
+    scan = compareCSV.filter_rows_by_column_prefix(
+        path, "Name", prefix, str(tmp_path / "a.csv"), case_sensitive=case_sensitive
+    )
+    indexed = compareCSV.filter_rows_by_column_prefix(
+        path,
+        "Name",
+        prefix,
+        str(tmp_path / "b.csv"),
+        case_sensitive=case_sensitive,
+        use_index=True,
+    )
+    assert indexed == scan
+    if scan:
+        assert _read_bytes(tmp_path / "b.csv") == _read_bytes(tmp_path / "a.csv")
+
+
+@pytest.mark.parametrize("word", ["cohiba", "ROBUSTO", "julie", "like", "obusto"])
+def test_word_prefix_index_matches_scan(tmp_path, word):
+    path = _write_csv(tmp_path / "in.csv", _rows(80))
+    scan = compareCSV.filter_rows_name_matches_word_prefix(path, word, str(tmp_path / "a.csv"))
+    indexed = compareCSV.filter_rows_name_matches_word_prefix(
+        path, word, str(tmp_path / "b.csv"), use_index=True
+    )
+    assert indexed == scan
+    if scan:
+        assert _read_bytes(tmp_path / "b.csv") == _read_bytes(tmp_path / "a.csv")